@@ -0,0 +1,95 @@
+#!/usr/bin/env python2
+'''Measure the speed and allocations of decoding chat messages.'''
+from __future__ import print_function, division
+
+import argparse
+import gc
+import random
+import shutil
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from vmchatinput.input import ChatInput
+
+
+WORDS = (
+    'up', 'down', 'left', 'right', 'a', 'b', 'start', 'select', 'Up', 'A',
+    'anarchy', 'democracy', '!bet', '100', 'blue', 'red', 'Kappa',
+    'BibleThump', 'entei', 'chatot', '@@@', '!move', 'lol', 'wow', 'kreygasm',
+    'this', 'is', 'a', 'long', 'message', 'with', 'many', 'words', 'in', 'it',
+)
+
+
+def generate_messages(count, seed=1):
+    rand = random.Random(seed)
+    messages = []
+
+    for dummy in range(count):
+        nick = 'Nick{}'.format(rand.randint(0, 1000))
+
+        if rand.random() < 0.8:
+            num_words = 1
+        else:
+            num_words = rand.randint(2, 15)
+
+        message = ' '.join(rand.choice(WORDS) for dummy in range(num_words))
+        messages.append((nick, message))
+
+    return messages
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--count', type=int, default=200000)
+    arg_parser.add_argument('--batch-size', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    messages = generate_messages(args.count)
+    batches = [messages[index:index + args.batch_size]
+               for index in range(0, len(messages), args.batch_size)]
+    log_dir = tempfile.mkdtemp()
+
+    try:
+        chat_input = ChatInput(log_dir)
+        chat_input._random.seed(1)
+
+        gc.collect()
+        start_time = time.time()
+
+        for batch in batches:
+            chat_input.decode_batch(batch)
+
+        duration = time.time() - start_time
+
+        print('Messages: {}'.format(args.count))
+        print('Time per message: {:.2f} us'.format(
+            duration / args.count * 1000000))
+
+        if tracemalloc and hasattr(tracemalloc, 'reset_peak'):
+            # The peak over a batch includes temporary objects that are freed
+            # before the batch is done.
+            peak_sizes = []
+            tracemalloc.start()
+
+            for batch in batches[:1000]:
+                tracemalloc.reset_peak()
+                current_before = tracemalloc.get_traced_memory()[0]
+                chat_input.decode_batch(batch)
+                peak_sizes.append(
+                    tracemalloc.get_traced_memory()[1] - current_before)
+
+            tracemalloc.stop()
+
+            print('Peak memory while decoding a batch: {:.0f} bytes'.format(
+                sum(peak_sizes) / len(peak_sizes)))
+    finally:
+        shutil.rmtree(log_dir)
+
+
+if __name__ == '__main__':
+    main()
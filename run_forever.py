@@ -1,56 +1,58 @@
 #!/usr/bin/env python2
 from __future__ import print_function
 
+import argparse
+import signal
 import subprocess
 import sys
 import time
 import atexit
 
 
-if __name__ == '__main__':
-    MIN_SLEEP_TIME = 60
-    MAX_SLEEP_TIME = 60 * 60
+MIN_SLEEP_TIME = 60
+MAX_SLEEP_TIME = 60 * 60
+STANDBY_WARMUP_TIME = 15
+STABLE_RUN_TIME = 60 * 10
 
-    assert MIN_SLEEP_TIME < MAX_SLEEP_TIME
+assert MIN_SLEEP_TIME < MAX_SLEEP_TIME
 
-    sleep_time = MIN_SLEEP_TIME
-    proc = None
 
-    @atexit.register
-    def cleanup():
-        if not proc:
-            return
-
-        print('Cleaning up...')
+def spawn(args):
+    return subprocess.Popen(
+        [sys.executable, '-m', 'vmchatinput'] + args
+    )
 
-        for dummy in range(50):
-            proc.poll()
-            if proc.returncode is None:
-                try:
-                    proc.terminate()
-                except OSError:
-                    pass
-
-                time.sleep(0.1)
-            else:
-                break
 
+def stop_proc(proc):
+    for dummy in range(50):
         proc.poll()
         if proc.returncode is None:
-            print('Force kill...')
             try:
-                proc.kill()
+                proc.terminate()
             except OSError:
                 pass
 
-        print('Cleanup done.')
+            time.sleep(0.1)
+        else:
+            break
+
+    proc.poll()
+    if proc.returncode is None:
+        print('Force kill...')
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+
+def run_simple(module_args, procs):
+    sleep_time = MIN_SLEEP_TIME
 
     while True:
         print('Running...')
         start_time = time.time()
-        proc = subprocess.Popen(
-            [sys.executable, '-m', 'vmchatinput'] + sys.argv[1:]
-        )
+        proc = spawn(module_args)
+        procs[:] = [proc]
 
         proc.communicate()
 
@@ -67,3 +69,104 @@ if __name__ == '__main__':
 
         sleep_time *= 2
         sleep_time = min(MAX_SLEEP_TIME, sleep_time)
+
+
+def run_warm_standby(module_args, procs):
+    # A standby process connects to IRC and loads the VirtualBox handle
+    # ahead of time. When the active process dies, the standby is told to
+    # take over the VM with SIGUSR1 and a new standby is started.
+    sleep_time = MIN_SLEEP_TIME
+    quick_failure = False
+
+    print('Running...')
+    active = spawn(module_args)
+    active_start_time = time.time()
+    standby = None
+    standby_start_time = None
+    standby_sleep_time = MIN_SLEEP_TIME
+    standby_restart_time = 0
+
+    while True:
+        procs[:] = [proc for proc in (active, standby) if proc]
+
+        if standby and standby.poll() is not None:
+            print('Standby exited.', standby.returncode)
+            standby = None
+
+            if time.time() - standby_start_time > STABLE_RUN_TIME:
+                standby_sleep_time = MIN_SLEEP_TIME
+
+            print('Delaying standby...', standby_sleep_time)
+            standby_restart_time = time.time() + standby_sleep_time
+            standby_sleep_time *= 2
+            standby_sleep_time = min(MAX_SLEEP_TIME, standby_sleep_time)
+
+        if not standby and time.time() - active_start_time > \
+                STANDBY_WARMUP_TIME and time.time() >= standby_restart_time:
+            print('Starting standby...')
+            standby = spawn(module_args + ['--standby'])
+            standby_start_time = time.time()
+
+        if active.poll() is None:
+            time.sleep(1)
+            continue
+
+        if active.returncode == 0:
+            break
+
+        if time.time() - active_start_time > STABLE_RUN_TIME:
+            quick_failure = False
+            sleep_time = MIN_SLEEP_TIME
+
+        if quick_failure:
+            print('Sleeping...', sleep_time)
+            time.sleep(sleep_time)
+
+            sleep_time *= 2
+            sleep_time = min(MAX_SLEEP_TIME, sleep_time)
+
+        quick_failure = True
+
+        if standby and standby.poll() is None:
+            warmup_remain = STANDBY_WARMUP_TIME - \
+                (time.time() - standby_start_time)
+
+            if warmup_remain > 0:
+                time.sleep(warmup_remain)
+
+            print('Promoting standby...')
+            standby.send_signal(signal.SIGUSR1)
+            active = standby
+            standby = None
+        else:
+            print('Running...')
+            active = spawn(module_args)
+
+        active_start_time = time.time()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument(
+        '--warm-standby', action='store_true',
+        help='keep a pre-initialized standby process ready to take over')
+    args, module_args = arg_parser.parse_known_args()
+
+    procs = []
+
+    @atexit.register
+    def cleanup():
+        if not procs:
+            return
+
+        print('Cleaning up...')
+
+        for proc in procs:
+            stop_proc(proc)
+
+        print('Cleanup done.')
+
+    if args.warm_standby:
+        run_warm_standby(module_args, procs)
+    else:
+        run_simple(module_args, procs)
@@ -1,17 +1,20 @@
+from __future__ import print_function
+
+from vmchatinput import startup
+
 import json
 import logging
 import atexit
-from logging.handlers import TimedRotatingFileHandler
-import os
 
 from six.moves import queue
 import argparse
 import signal
 import sys
-from vmchatinput.compress import CompressThread
+import time
 
-from vmchatinput.irc import IRCThread
-from vmchatinput.vm import VMThread
+from vmchatinput import logconf
+from vmchatinput import profiler
+from vmchatinput.supervisor import Supervisor
 
 _logger = logging.getLogger(__name__)
 
@@ -20,68 +23,199 @@ def main():
     message_queue = queue.Queue(10)
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument('config_file')
+    arg_parser.add_argument(
+        '--standby', action='store_true',
+        help='initialize and wait for SIGUSR1 before taking over the VM')
+    arg_parser.add_argument(
+        '--startup-report', action='store_true',
+        help='print the time spent in each startup phase')
     args = arg_parser.parse_args()
 
-    with open(args.config_file) as file:
-        config = json.load(file)
-
-    if config.get('debug'):
-        log_level = logging.DEBUG
-    else:
-        log_level = logging.INFO
-
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
-
-    log_handler = TimedRotatingFileHandler(
-        os.path.join(config['log_dir'], 'log'),
-        utc=True, when='midnight',
-    )
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log_handler.setFormatter(formatter)
-
-    console_handler.setLevel(log_level)
-    log_handler.setLevel(log_level)
-
-    root_logger = logging.getLogger()
-    root_logger.setLevel(log_level)
-    root_logger.addHandler(console_handler)
-    root_logger.addHandler(log_handler)
-
-    irc_thread = IRCThread(message_queue, config['channel'], config['server'])
-    vm_thread = VMThread(message_queue, config['virtual_machine'],
-                         config['log_dir'], config.get('minimized_gui'))
-    compress_thread = CompressThread(config['log_dir'])
-
-    threads = [irc_thread, vm_thread, compress_thread]
-    non_local_dict = {'running': True}
-
-    for thread in threads:
-        thread.start()
+    with startup.phase('config'):
+        with open(args.config_file) as file:
+            config = json.load(file)
+
+    with startup.phase('logging'):
+        logconf.setup_logging(
+            config, logconf.STANDBY_LOG_FILENAME if args.standby
+            else logconf.LOG_FILENAME)
+
+    non_local_dict = {'running': True, 'active': not args.standby,
+                      'reported': not args.startup_report,
+                      'keyword_tables': None}
+
+    # Modules are imported by the factories so each thread starts as soon
+    # as its own module is loaded. The IRC connection is made while the
+    # VirtualBox modules are still loading and the VirtualBox handle is
+    # set up in the VM thread.
+    def new_irc_thread():
+        with startup.phase('import irc'):
+            from vmchatinput.irc import IRCThread
+
+        return IRCThread(message_queue, config['channel'], config['server'])
+
+    def new_vm_thread():
+        with startup.phase('import vm'):
+            from vmchatinput.vm import VMThread
+            from vmchatinput.input import KeywordTables
+
+        if not non_local_dict['keyword_tables']:
+            non_local_dict['keyword_tables'] = \
+                KeywordTables.from_config(config.get('input', {}))
+
+        return VMThread(message_queue, config['virtual_machine'],
+                        config['log_dir'], config.get('minimized_gui'),
+                        standby=not non_local_dict['active'],
+                        keyword_tables=non_local_dict['keyword_tables'],
+                        adaptive_pacing=config.get('adaptive_pacing'),
+                        state_save_interval=config.get(
+                            'state_save_interval', 10),
+                        latency_slo=config.get('latency_slo'),
+                        latency_tracing=config.get('latency_tracing') or
+                        config.get('log_latency'),
+                        log_latency=config.get('log_latency'),
+                        screenshot_ring_size=config.get(
+                            'screenshot_ring_size'),
+                        screenshot_ring_max_bytes=config.get(
+                            'screenshot_ring_max_bytes'),
+                        screenshot_archive_interval=config.get(
+                            'screenshot_archive_interval'))
+
+    def new_compress_thread():
+        from vmchatinput.compress import CompressThread
+
+        return CompressThread(
+            config['log_dir'],
+            update_log_index=config.get('log_index'),
+            screenshot_full_days=config.get('screenshot_full_days'),
+            input_log_archive_days=config.get('input_log_archive_days'),
+            storage_budget=config.get('storage_budget'),
+        )
+
+    def new_echo_thread():
+        from vmchatinput.echo import EchoThread
+
+        return EchoThread(config.get('echo_rate', 20))
+
+    def new_dashboard_thread():
+        from vmchatinput.dashboard import DashboardThread
+
+        return DashboardThread(config['dashboard_port'],
+                               config.get('dashboard_host', '127.0.0.1'))
+
+    def reload_config(new_config):
+        from vmchatinput.input import KeywordTables
+
+        keyword_tables = KeywordTables.from_config(new_config.get('input', {}))
+        non_local_dict['keyword_tables'] = keyword_tables
+
+        if supervisor.get('vm'):
+            supervisor.get('vm').set_keyword_tables(keyword_tables)
+
+        _logger.info('Keyword tables reloaded.')
+
+    def new_config_watcher():
+        from vmchatinput.configwatch import ConfigWatcher
+
+        return ConfigWatcher(args.config_file, reload_config,
+                             config.get('config_reload_interval', 2))
+
+    supervisor = Supervisor()
+    supervisor.add('irc', new_irc_thread,
+                   stall_timeout=config.get('irc_stall_timeout', 60))
+    supervisor.add('vm', new_vm_thread,
+                   stall_timeout=config.get('vm_stall_timeout', 300))
+    supervisor.add('compress', new_compress_thread,
+                   stall_timeout=config.get('compress_stall_timeout', 3600 * 2))
 
     @atexit.register
     def cleanup():
         if non_local_dict['running']:
             non_local_dict['running'] = False
-            for thread in threads:
-                _logger.info('Stopping thread %s', thread)
-                thread.stop()
-                thread.join(1)
+            supervisor.stop()
 
             _logger.info('Threads stopped.')
 
     def stop(dummy1, dummy2):
         cleanup()
 
+    def activate(dummy1, dummy2):
+        if non_local_dict['active']:
+            return
+
+        _logger.info('Standby activated.')
+        non_local_dict['active'] = True
+        logconf.set_log_filename(logconf.LOG_FILENAME)
+
+        if supervisor.get('vm'):
+            supervisor.get('vm').activate()
+
+        if not supervisor.get('compress'):
+            supervisor.start('compress')
+
+        if config.get('dashboard_port') and not supervisor.get('dashboard'):
+            supervisor.start('dashboard')
+
+    def persist_screenshots(dummy1, dummy2):
+        if supervisor.get('vm'):
+            supervisor.get('vm').request_screenshot_persist()
+
+    def profile(dummy1, dummy2):
+        profiler.start_profiler(config['log_dir'],
+                                config.get('profile_duration', 30))
+
     signal.signal(signal.SIGINT, stop)
     signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGUSR1, activate)
+    signal.signal(signal.SIGUSR2, profile)
+    signal.signal(signal.SIGHUP, persist_screenshots)
+
+    if config.get('trace_spans'):
+        profiler.set_tracing(True)
+
+    if config.get('profile_on_start'):
+        profiler.start_profiler(config['log_dir'],
+                                config.get('profile_duration', 30))
+
+    if args.standby:
+        _logger.info('Starting as standby.')
+
+    if config.get('dashboard_port'):
+        supervisor.add('dashboard', new_dashboard_thread, stall_timeout=60)
+
+    supervisor.start('irc')
+
+    if config.get('echo_input', True):
+        supervisor.add('echo', new_echo_thread, stall_timeout=60)
+        supervisor.start('echo')
+
+    supervisor.start('vm')
+
+    if config.get('config_reload_interval', 2):
+        # The watcher heartbeats once per check.
+        supervisor.add('config', new_config_watcher, stall_timeout=max(
+            60, 3 * config.get('config_reload_interval', 2)))
+        supervisor.start('config')
+
+    if non_local_dict['active'] and not supervisor.get('compress'):
+        supervisor.start('compress')
+
+    # The dashboard port is held by the active process so a standby only
+    # starts its dashboard once activated.
+    if non_local_dict['active'] and config.get('dashboard_port') and \
+            not supervisor.get('dashboard'):
+        supervisor.start('dashboard')
 
     while non_local_dict['running']:
-        for thread in threads:
-            thread.join(timeout=1)
+        time.sleep(1)
+
+        if non_local_dict['running']:
+            supervisor.check()
 
-            if not thread.is_alive() and non_local_dict['running']:
-                raise Exception('A thread died: {}'.format(thread))
+        if not non_local_dict['reported'] and \
+                startup.is_done('irc', 'virtualbox'):
+            non_local_dict['reported'] = True
+            print(startup.format_report(), file=sys.stderr)
 
     _logger.info('Quiting.')
 
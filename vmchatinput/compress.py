@@ -7,6 +7,10 @@ import subprocess
 import threading
 import time
 
+from vmchatinput.logindex import LogIndex
+from vmchatinput.retention import RetentionManager
+from vmchatinput.supervisor import HeartbeatThread
+
 
 _logger = logging.getLogger(__name__)
 
@@ -15,10 +19,12 @@ INPUT_LOG_GLOB = '/[0-9]*-*-*[0-9].csv'
 IMAGES_GLOB = '/[0-9]*-*-*[0-9]/[0-9]*T*[0-9].png'
 
 
-class CompressThread(threading.Thread):
-    def __init__(self, log_dir):
-        threading.Thread.__init__(self)
+class CompressThread(HeartbeatThread):
+    def __init__(self, log_dir, update_log_index=False, **retention_kwargs):
+        HeartbeatThread.__init__(self)
         self._log_dir = log_dir
+        self._update_log_index = update_log_index
+        self._retention_manager = RetentionManager(log_dir, **retention_kwargs)
 
         self.daemon = True
         self._stop_event = threading.Event()
@@ -29,7 +35,9 @@ class CompressThread(threading.Thread):
 
         while self._running:
             self._compress_files()
+            self.heartbeat()
             self._stop_event.wait(3600)
+            self.heartbeat()
 
     def stop(self):
         self._running = False
@@ -41,6 +49,32 @@ class CompressThread(threading.Thread):
         self._compress_images()
         self._deduplicate_images()
 
+        # Logs are indexed before they can be archived or deleted.
+        if self._update_log_index:
+            self._index_logs()
+
+        removed_screenshots = self._retention_manager.run(self.heartbeat)
+
+        if self._update_log_index and removed_screenshots:
+            self._forget_screenshots(removed_screenshots)
+
+    def _index_logs(self):
+        self.heartbeat()
+        log_index = LogIndex(self._log_dir)
+
+        try:
+            log_index.update()
+        finally:
+            log_index.close()
+
+    def _forget_screenshots(self, names):
+        log_index = LogIndex(self._log_dir)
+
+        try:
+            log_index.forget_screenshots(names)
+        finally:
+            log_index.close()
+
     def _compress_log_files(self):
         pattern = self._log_dir + LOG_GLOB
 
@@ -80,6 +114,7 @@ class CompressThread(threading.Thread):
         return False
 
     def _compress_xz(self, filename):
+        self.heartbeat()
         _logger.info('Compressing file %s', filename)
         assert not filename.endswith('.xz')
 
@@ -90,6 +125,7 @@ class CompressThread(threading.Thread):
             raise Exception('xz exited abnormally: {}'.format(proc.returncode))
 
     def _compress_pngcrush(self, filename):
+        self.heartbeat()
         _logger.info('Compressing image %s', filename)
 
         assert filename.endswith('.png')
@@ -135,6 +171,7 @@ class CompressThread(threading.Thread):
                 _logger.debug('rdfind not available')
                 break
 
+            self.heartbeat()
             _logger.info('Running rdfind on %s', dir_path)
             proc.communicate()
 
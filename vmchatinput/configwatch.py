@@ -0,0 +1,63 @@
+import json
+import logging
+import os
+import threading
+
+from vmchatinput.supervisor import HeartbeatThread
+
+
+_logger = logging.getLogger(__name__)
+
+
+class ConfigWatcher(HeartbeatThread):
+    '''Polls the config file and calls back with the new config on change.
+
+    A config that fails to load or that the callback fails on is logged and
+    the previous config stays in effect.
+    '''
+    def __init__(self, path, callback, interval=2):
+        HeartbeatThread.__init__(self)
+        self._path = path
+        self._callback = callback
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._running = False
+        self._file_stat = self._get_file_stat()
+        self.daemon = True
+
+    def run(self):
+        self._running = True
+
+        while self._running:
+            self.heartbeat()
+            self._stop_event.wait(self._interval)
+
+            file_stat = self._get_file_stat()
+
+            if file_stat != self._file_stat:
+                self._file_stat = file_stat
+                self._reload()
+
+    def stop(self):
+        self._running = False
+        self._stop_event.set()
+
+    def _get_file_stat(self):
+        try:
+            stat_result = os.stat(self._path)
+        except OSError:
+            return None
+
+        return stat_result.st_mtime, stat_result.st_size, stat_result.st_ino
+
+    def _reload(self):
+        _logger.info('Reloading config %s', self._path)
+
+        try:
+            with open(self._path) as file:
+                config = json.load(file)
+
+            self._callback(config)
+        except Exception:
+            # Any error in a hand edited config must not kill the thread.
+            _logger.exception('Failed to reload config')
@@ -0,0 +1,270 @@
+from __future__ import absolute_import
+
+import collections
+import json
+import logging
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer, socketserver
+
+from vmchatinput import events
+from vmchatinput.supervisor import HeartbeatThread
+
+
+_logger = logging.getLogger(__name__)
+
+RATE_WINDOW = 60
+RECENT_INPUTS = 20
+THUMBNAIL_SIZE = (320, 240)
+BIND_RETRY_INTERVAL = 30
+
+PAGE = b'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>vmchatinput</title>
+<style>
+body { font-family: sans-serif; }
+table { border-collapse: collapse; }
+td, th { padding: 0.2em 1em; text-align: left; }
+</style>
+</head>
+<body>
+<img id="screenshot" src="screenshot.png" alt="">
+<h2>Rates (per second, last minute)</h2>
+<table id="rates"></table>
+<h2>Recent inputs</h2>
+<table id="inputs"></table>
+<p id="status"></p>
+<script>
+function row(cells) {
+    var tr = document.createElement('tr');
+    cells.forEach(function (cell) {
+        var td = document.createElement('td');
+        td.textContent = cell;
+        tr.appendChild(td);
+    });
+    return tr;
+}
+function refresh() {
+    fetch('stats').then(function (response) {
+        return response.json();
+    }).then(function (stats) {
+        var rates = document.getElementById('rates');
+        var inputs = document.getElementById('inputs');
+        rates.innerHTML = '';
+        inputs.innerHTML = '';
+        Object.keys(stats.rates).sort().forEach(function (name) {
+            rates.appendChild(row([name, stats.rates[name].toFixed(2)]));
+        });
+        stats.recent_inputs.forEach(function (item) {
+            inputs.appendChild(row(item));
+        });
+        document.getElementById('status').textContent =
+            'Last frozen check: ' + stats.last_frozen_check +
+            ', last reset: ' + stats.last_reset +
+            ', dropped events: ' + stats.dropped_events;
+        if (stats.screenshot_time !== window.screenshotTime) {
+            window.screenshotTime = stats.screenshot_time;
+            document.getElementById('screenshot').src =
+                'screenshot.png?' + stats.screenshot_time;
+        }
+    });
+}
+refresh();
+setInterval(refresh, 2000);
+</script>
+</body>
+</html>
+'''
+
+
+class DashboardStats(object):
+    '''Aggregates events for the dashboard.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = collections.deque()
+        self._recent_inputs = collections.deque((), RECENT_INPUTS)
+        self._last_frozen_check = None
+        self._last_reset = None
+        self._screenshot_data = None
+        self._screenshot_time = None
+        self._thumbnail = None
+
+    def add(self, event):
+        second = int(event.time)
+
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append((second, collections.Counter()))
+
+            self._buckets[-1][1][event.type] += 1
+            self._prune_buckets(second)
+
+            if event.type == 'input':
+                self._recent_inputs.appendleft(
+                    (time.strftime('%H:%M:%S', time.gmtime(event.time)),
+                     event.data['nick'], event.data['value'])
+                )
+            elif event.type == 'frozen_check':
+                self._last_frozen_check = '{} ({})'.format(
+                    time.strftime('%H:%M:%S', time.gmtime(event.time)),
+                    'frozen' if event.data['frozen'] else 'ok'
+                )
+            elif event.type == 'reset':
+                self._last_reset = '{} ({})'.format(
+                    time.strftime('%H:%M:%S', time.gmtime(event.time)),
+                    event.data['reason']
+                )
+            elif event.type == 'screenshot':
+                self._screenshot_data = event.data['data']
+                self._screenshot_time = event.time
+                self._thumbnail = None
+
+    def _prune_buckets(self, second):
+        while self._buckets and self._buckets[0][0] <= second - RATE_WINDOW:
+            self._buckets.popleft()
+
+    def get_stats(self, dropped_events):
+        with self._lock:
+            # Events may have stopped so the window ends at the current time.
+            self._prune_buckets(int(time.time()))
+            counter = collections.Counter()
+
+            for dummy, bucket_counter in self._buckets:
+                counter.update(bucket_counter)
+
+            return {
+                'rates': dict(
+                    (name, count / float(RATE_WINDOW))
+                    for name, count in counter.items()
+                ),
+                'recent_inputs': list(self._recent_inputs),
+                'last_frozen_check': self._last_frozen_check,
+                'last_reset': self._last_reset,
+                'screenshot_time': self._screenshot_time,
+                'dropped_events': dropped_events,
+            }
+
+    def get_thumbnail(self):
+        with self._lock:
+            if self._thumbnail is None and self._screenshot_data:
+                self._thumbnail = make_thumbnail(self._screenshot_data)
+
+            return self._thumbnail
+
+
+def make_thumbnail(image_data):
+    import PIL.Image
+
+    image = PIL.Image.open(six.BytesIO(image_data))
+    image.thumbnail(THUMBNAIL_SIZE)
+    file = six.BytesIO()
+    image.save(file, 'PNG')
+
+    return file.getvalue()
+
+
+class DashboardServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class DashboardRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+
+        if path == '/':
+            self._send(PAGE, 'text/html; charset=utf-8')
+        elif path == '/stats':
+            stats = self.server.dashboard.get_stats()
+            self._send(json.dumps(stats).encode('utf-8'), 'application/json')
+        elif path == '/screenshot.png':
+            thumbnail = self.server.dashboard.get_thumbnail()
+
+            if thumbnail:
+                self._send(thumbnail, 'image/png')
+            else:
+                self.send_error(404)
+        else:
+            self.send_error(404)
+
+    def _send(self, data, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        _logger.debug(format, *args)
+
+
+class DashboardThread(HeartbeatThread):
+    '''Serves a page with live rates and the latest screenshot.'''
+    def __init__(self, port, host='127.0.0.1'):
+        HeartbeatThread.__init__(self)
+        self._address = (host, port)
+        self._running = False
+        self._server = None
+        self._subscription = None
+        self._stats = DashboardStats()
+        self.daemon = True
+
+    def run(self):
+        self._running = True
+        self._subscription = events.subscribe()
+        bind_time = None
+
+        while self._running:
+            self.heartbeat()
+
+            if not self._server and (
+                    bind_time is None or
+                    time.time() - bind_time >= BIND_RETRY_INTERVAL):
+                bind_time = time.time()
+                self._start_server()
+
+            event = self._subscription.get(timeout=1)
+
+            if event:
+                self._stats.add(event)
+
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+        self._subscription.close()
+
+        _logger.info('Stopped dashboard.')
+
+    def _start_server(self):
+        # A failed bind is retried instead of letting the thread die and be
+        # restarted by the supervisor until it gives up.
+        try:
+            server = DashboardServer(self._address, DashboardRequestHandler)
+        except (IOError, OSError) as error:
+            _logger.error('Dashboard cannot listen on %s:%d: %s',
+                          self._address[0], self._address[1], error)
+            return
+
+        _logger.info('Starting dashboard on %s:%d.', *self._address)
+
+        server.dashboard = self
+        self._server = server
+
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def get_stats(self):
+        return self._stats.get_stats(self._subscription.dropped)
+
+    def get_thumbnail(self):
+        return self._stats.get_thumbnail()
@@ -0,0 +1,54 @@
+from __future__ import print_function
+
+import sys
+
+from vmchatinput import events
+from vmchatinput.supervisor import HeartbeatThread
+
+
+class EchoThread(HeartbeatThread):
+    '''Prints input actions to stderr, up to a number of lines per second.
+
+    Lines over the rate are skipped and summarized.
+    '''
+    def __init__(self, max_rate=20):
+        HeartbeatThread.__init__(self)
+        self._max_rate = max_rate
+        self._running = False
+        self.daemon = True
+
+    def run(self):
+        self._running = True
+        subscription = events.subscribe()
+        second = None
+        count = 0
+        skipped = 0
+
+        while self._running:
+            self.heartbeat()
+            event = subscription.get(timeout=1)
+
+            if not event or event.type != 'input':
+                continue
+
+            event_second = int(event.time)
+
+            if event_second != second:
+                if skipped:
+                    print('> ({} skipped)'.format(skipped), file=sys.stderr)
+
+                second = event_second
+                count = 0
+                skipped = 0
+
+            if count < self._max_rate:
+                count += 1
+                print('>', event.data['nick'], event.data['value'],
+                      file=sys.stderr)
+            else:
+                skipped += 1
+
+        subscription.close()
+
+    def stop(self):
+        self._running = False
@@ -0,0 +1,85 @@
+import collections
+import logging
+import threading
+import time
+
+from six.moves import queue
+
+
+_logger = logging.getLogger(__name__)
+
+
+Event = collections.namedtuple('Event', ['type', 'time', 'data'])
+
+
+class Subscription(object):
+    '''Bounded queue of events for one subscriber.
+
+    Publishing never blocks. Events that do not fit are dropped and counted
+    so a slow subscriber cannot hold up the input path.
+    '''
+    def __init__(self, bus, maxsize):
+        self._bus = bus
+        self._queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = ()
+
+    def subscribe(self, maxsize=1000):
+        subscription = Subscription(self, maxsize)
+
+        with self._lock:
+            self._subscriptions += (subscription,)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(
+                item for item in self._subscriptions
+                if item is not subscription
+            )
+
+    def publish(self, event_type, **data):
+        # The tuple is replaced instead of modified so it can be read
+        # without the lock.
+        subscriptions = self._subscriptions
+
+        if not subscriptions:
+            return
+
+        event = Event(event_type, time.time(), data)
+
+        for subscription in subscriptions:
+            subscription.put(event)
+
+
+bus = EventBus()
+
+
+def publish(event_type, **data):
+    bus.publish(event_type, **data)
+
+
+def subscribe(maxsize=1000):
+    return bus.subscribe(maxsize)
+
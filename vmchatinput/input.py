@@ -7,10 +7,17 @@ import os
 import random
 import string
 import time
-import sys
 import collections
 
-from virtualbox.library_ext.keyboard import SCANCODES
+import six
+
+from vmchatinput import events
+from vmchatinput.macro import compile_keys, compile_macro, compile_table, \
+    get_log_value, MacroError
+from vmchatinput.latency import LatencyRecorder
+from vmchatinput.pacing import PacingController
+from vmchatinput.shedding import LoadShedder
+from vmchatinput.profiler import traced
 
 _logger = logging.getLogger(__name__)
 
@@ -61,9 +68,9 @@ EXTRA_INPUT_KEYWORDS = {
     'music': 'LWIN',
     'kapow': 'CAPS',
 
-    'entei': ['f', 'ALT'],
-    'chatot': ['s', 'CTRL'],
-    'blaziken': ['F4', 'ALT'],
+    'entei': 'ALT+f',
+    'chatot': 'CTRL+s',
+    'blaziken': 'ALT+F4',
 
     '***': 'E_DEL',
     'wow': 'ESC',
@@ -80,7 +87,7 @@ KAPOW_WORDS = frozenset([
     '!explosion',
     '!selfdestruct',
 ])
-KAPOW_WORDS_TRUNCATED = frozenset([word[:7] for word in KAPOW_WORDS])
+KAPOW_TRUNCATE_LENGTH = 7
 RULE_BREAK_WORDS = frozenset([
     '/me', 'non-whitelisted', 'excessive',
 ])
@@ -88,22 +95,197 @@ EMOTE_WORDS = frozenset([
     'kappa', 'trihard', 'wutface', 'onehand', 'dansgame', 'failfish',
     'brokeback', 'residentsleeper', 'biblethump', 'deilluminati',
 ])
+MAX_ALT_TAB = 10
+ALT_TAB_MACROS = tuple(
+    'ALT+TAB*{}'.format(num) for num in range(MAX_ALT_TAB + 1))
+RANDOM_COMBO_MACROS = tuple(
+    '{}+{}'.format(modifier, key)
+    for key in KEYS for modifier in KEY_MODIFIERS
+)
 MAX_MOUSE_MOVE_AMOUNT = 64
+SCREENSHOT_RING_SIZE = 30
+SCREENSHOT_RING_MAX_BYTES = 16 * 1024 * 1024
+SCREENSHOT_SAMPLE_INTERVAL = 3600
+
+
+class KeywordTables(object):
+    '''Keyword tables compiled into the lookups used by the decoder.
+
+    The tables are not modified once built. To change them, build a new
+    instance and pass it to :meth:`ChatInput.set_keyword_tables`. Tables of
+    the wrong type and macros that do not compile raise ``ValueError``.
+    '''
+    def __init__(self, input_keys=INPUT_KEYS,
+                 extra_input_keywords=EXTRA_INPUT_KEYWORDS,
+                 kapow_words=KAPOW_WORDS, rule_break_words=RULE_BREAK_WORDS,
+                 emote_words=EMOTE_WORDS,
+                 max_mouse_move_amount=MAX_MOUSE_MOVE_AMOUNT):
+        check_mapping('input_keys', input_keys)
+        check_mapping('extra_input_keywords', extra_input_keywords)
+        check_collection('kapow_words', kapow_words)
+        check_collection('rule_break_words', rule_break_words)
+        check_collection('emote_words', emote_words)
+
+        self.input_keys = dict(
+            (word.lower(), key) for word, key in input_keys.items())
+        self.input_keys_values = tuple(self.input_keys.values())
+        self.extra_input_keywords = dict(
+            (word.lower(), macro)
+            for word, macro in extra_input_keywords.items()
+        )
+        self.extra_input_keywords_set = frozenset(self.extra_input_keywords)
+        self.kapow_words_truncated = frozenset(
+            [word.lower()[:KAPOW_TRUNCATE_LENGTH] for word in kapow_words])
+        self.rule_break_words = frozenset(
+            [word.lower() for word in rule_break_words])
+        self.emote_words = frozenset([word.lower() for word in emote_words])
+        self.max_mouse_move_amount = int(max_mouse_move_amount)
+        self.key_programs = compile_table(
+            frozenset(ALT_TAB_MACROS) | frozenset(RANDOM_COMBO_MACROS))
+
+        # A macro that does not compile would be logged but send nothing.
+        for macro in frozenset(self.input_keys_values) | \
+                frozenset(self.extra_input_keywords.values()):
+            try:
+                self.key_programs[macro] = compile_macro(macro)
+            except MacroError as error:
+                raise ValueError('Bad macro {}: {}'.format(macro, error))
+
+        if self.max_mouse_move_amount <= 0:
+            raise ValueError('max_mouse_move_amount must be positive')
+
+    @classmethod
+    def from_config(cls, config):
+        '''Build the tables from the ``input`` section of the config.
+
+        Tables missing from the config keep their defaults.
+        '''
+        if not isinstance(config, dict):
+            raise ValueError('input config must be a mapping')
+
+        return cls(
+            input_keys=config.get('input_keys', INPUT_KEYS),
+            extra_input_keywords=config.get('extra_input_keywords',
+                                            EXTRA_INPUT_KEYWORDS),
+            kapow_words=config.get('kapow_words', KAPOW_WORDS),
+            rule_break_words=config.get('rule_break_words',
+                                        RULE_BREAK_WORDS),
+            emote_words=config.get('emote_words', EMOTE_WORDS),
+            max_mouse_move_amount=config.get('max_mouse_move_amount',
+                                             MAX_MOUSE_MOVE_AMOUNT),
+        )
+
+
+def check_mapping(name, table):
+    if not isinstance(table, dict):
+        raise ValueError('{} must be a mapping'.format(name))
+
+    for word, macro in table.items():
+        if not isinstance(word, six.string_types) or \
+                not isinstance(macro, six.string_types):
+            raise ValueError('{} must map words to macros'.format(name))
+
+
+def check_collection(name, words):
+    if isinstance(words, six.string_types) or \
+            not isinstance(words, (list, tuple, set, frozenset)):
+        raise ValueError('{} must be a list of words'.format(name))
+
+    for word in words:
+        if not isinstance(word, six.string_types):
+            raise ValueError('{} must be a list of words'.format(name))
+
+
+class ScreenshotRing(object):
+    '''Bounded history of recent screenshots kept in memory.
+
+    The oldest frames are dropped when either the number of frames or
+    their total size goes over the limit.
+    '''
+    def __init__(self, max_frames=SCREENSHOT_RING_SIZE,
+                 max_bytes=SCREENSHOT_RING_MAX_BYTES):
+        self._max_frames = max_frames
+        self._max_bytes = max_bytes
+        self._frames = collections.deque()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def size(self):
+        return self._size
+
+    def add(self, datetime_, data):
+        self._frames.append((datetime_, data))
+        self._size += len(data)
+
+        while self._frames and (len(self._frames) > self._max_frames or
+                                self._size > self._max_bytes):
+            dummy, old_data = self._frames.popleft()
+            self._size -= len(old_data)
+
+    def pop_all(self):
+        frames = list(self._frames)
+        self._frames.clear()
+        self._size = 0
+
+        return frames
 
 
 class InputLogger(object):
-    def __init__(self, log_dir):
+    def __init__(self, log_dir, screenshot_ring_size=None,
+                 screenshot_ring_max_bytes=None,
+                 screenshot_archive_interval=None, log_latency=False):
         self._log_dir = log_dir
+        self._log_latency = log_latency
         self._current_date = None
         self._log_file = None
         self._log_writer = None
+        self._screenshots = ScreenshotRing(
+            screenshot_ring_size or SCREENSHOT_RING_SIZE,
+            screenshot_ring_max_bytes or SCREENSHOT_RING_MAX_BYTES
+        )
+        self._screenshot_sample_interval = min(
+            SCREENSHOT_SAMPLE_INTERVAL,
+            screenshot_archive_interval or SCREENSHOT_SAMPLE_INTERVAL
+        )
+        self._last_screenshot_sample_time = None
 
     def save_screenshot(self, data):
-        with open(self._get_screenshot_path(), 'wb') as file:
-            file.write(data)
+        '''Keep a screenshot in memory, writing a sample to disk once in a
+        while.
 
-    def _get_screenshot_path(self):
+        Call :meth:`persist_screenshots` to write the frames in memory when
+        something worth looking at happens.
+        '''
         datetime_now = datetime.datetime.utcnow()
+        time_now = time.time()
+
+        events.publish('screenshot', data=data)
+
+        if self._last_screenshot_sample_time is None or \
+                time_now - self._last_screenshot_sample_time >= \
+                self._screenshot_sample_interval:
+            self._last_screenshot_sample_time = time_now
+            self._write_screenshot(datetime_now, data)
+        else:
+            self._screenshots.add(datetime_now, data)
+
+    def persist_screenshots(self, reason):
+        frames = self._screenshots.pop_all()
+
+        if frames:
+            _logger.info('Saving %d screenshots (%s)', len(frames), reason)
+
+        for datetime_, data in frames:
+            self._write_screenshot(datetime_, data)
+
+    def _write_screenshot(self, datetime_, data):
+        with open(self._get_screenshot_path(datetime_), 'wb') as file:
+            file.write(data)
+
+    def _get_screenshot_path(self, datetime_now):
         date_str = datetime_now.date().isoformat()
         datetime_str = datetime_now.isoformat()
 
@@ -115,7 +297,7 @@ class InputLogger(object):
 
         return file_path
 
-    def write_log(self, nick, value):
+    def write_log(self, nick, value, latency=None):
         datetime_now = datetime.datetime.utcnow()
         date_now = datetime_now.date()
 
@@ -126,9 +308,15 @@ class InputLogger(object):
             self._open_log_file()
             self._current_date = date_now
 
-        self._log_writer.writerow([datetime_now.isoformat(), nick, value])
+        if self._log_latency:
+            self._log_writer.writerow([
+                datetime_now.isoformat(), nick, value,
+                '{:.4f}'.format(latency) if latency is not None else ''
+            ])
+        else:
+            self._log_writer.writerow([datetime_now.isoformat(), nick, value])
 
-        print('>', nick, value, file=sys.stderr)
+        events.publish('input', nick=nick, value=value)
 
     def _open_log_file(self):
         date_str = datetime.datetime.utcnow().date().isoformat()
@@ -137,24 +325,94 @@ class InputLogger(object):
         self._log_writer = csv.writer(self._log_file)
 
 
-ChatData = collections.namedtuple(
-    '_ChatData',
-    [
-        'nick', 'message', 'words', 'lowered_words', 'lowered_words_set',
-        'first_word'
-    ]
+class ChatData(object):
+    '''Tokens of a chat message, split only as far as needed.
+
+    Most messages are a single command so only the first word is split
+    off up front. The list of words and the set of lowered words are
+    built the first time a rule asks for them. One instance is reused for
+    every message decoded by a :class:`ChatInput`.
+    '''
+    __slots__ = ('nick', 'message', 'first_word', '_words',
+                 '_lowered_words_set', '_lowered_cache')
+
+    def __init__(self):
+        self.reset(None, None, None)
+
+    def reset(self, nick, message, lowered_cache):
+        self.nick = nick
+        self.message = message
+        self._lowered_words_set = None
+        self._lowered_cache = lowered_cache
+
+        if message:
+            head = message.split(None, 1)
+            self.first_word = self._lower(head[0])
+
+            # A message of one word is already fully split.
+            self._words = head if len(head) == 1 else None
+        else:
+            self.first_word = None
+            self._words = None
+
+    @property
+    def words(self):
+        if self._words is None:
+            self._words = self.message.split()
+
+        return self._words
+
+    @property
+    def lowered_words_set(self):
+        if self._lowered_words_set is None:
+            words = self.words
+
+            if len(words) == 1:
+                self._lowered_words_set = frozenset((self.first_word,))
+            elif self._lowered_cache is None:
+                self._lowered_words_set = frozenset(
+                    [word.lower() for word in words])
+            else:
+                cache = self._lowered_cache
+                self._lowered_words_set = frozenset(
+                    [cache.get(word) or cache.setdefault(word, word.lower())
+                     for word in words])
+
+        return self._lowered_words_set
+
+    def _lower(self, word):
+        if self._lowered_cache is None:
+            return word.lower()
+
+        lowered_word = self._lowered_cache.get(word)
+
+        if lowered_word is None:
+            lowered_word = self._lowered_cache[word] = word.lower()
+
+        return lowered_word
+
+
+Action = collections.namedtuple(
+    '_Action', ['nick', 'log_value', 'function', 'args', 'received_time']
 )
+Action.__new__.__defaults__ = (None,)
 
 
 class ChatInput(object):
-    def __init__(self, log_dir):
-        self._logging = InputLogger(log_dir)
+    def __init__(self, log_dir, keyword_tables=None, pacing=None,
+                 shedder=None, latency=None, **logger_kwargs):
+        self._logging = InputLogger(log_dir, **logger_kwargs)
+        self._keyword_tables = keyword_tables or KeywordTables()
+        self._pacing = pacing or PacingController()
+        self._shedder = shedder or LoadShedder()
+        self._latency = latency or LatencyRecorder()
         self._input_counter = 0
         self._vbox_console = None
         self._prev_button_flags = 0
         self._random = random.Random()
         self._is_key_input_state = True
         self._is_word_input_state = False
+        self._chat_data = ChatData()
 
     @property
     def input_counter(self):
@@ -164,114 +422,228 @@ class ChatInput(object):
     def input_logger(self):
         return self._logging
 
+    @property
+    def pacing(self):
+        return self._pacing
+
+    @property
+    def shedder(self):
+        return self._shedder
+
+    @property
+    def latency(self):
+        return self._latency
+
+    def set_keyword_tables(self, keyword_tables):
+        # Replacing the reference is atomic. A batch being decoded keeps
+        # the tables it started with.
+        self._keyword_tables = keyword_tables
+
+    def get_state(self):
+        '''Return the counter, modes, and random state as a JSON-able dict.'''
+        return {
+            'input_counter': self._input_counter,
+            'is_key_input_state': self._is_key_input_state,
+            'is_word_input_state': self._is_word_input_state,
+            'prev_button_flags': self._prev_button_flags,
+            'random_state': self._random.getstate(),
+        }
+
+    def set_state(self, state):
+        '''Restore a state from :meth:`get_state`.'''
+        version, internal_state, gauss_next = state['random_state']
+        self._random.setstate((version, tuple(internal_state), gauss_next))
+        self._input_counter = int(state['input_counter'])
+        self._is_key_input_state = bool(state['is_key_input_state'])
+        self._is_word_input_state = bool(state['is_word_input_state'])
+        self._prev_button_flags = int(state['prev_button_flags'])
+
     def process_input(self, nick, message, vbox_console):
-        self._vbox_console = vbox_console
-        nick = nick.lower()
+        self.process_batch([(nick, message)], vbox_console)
+
+    @traced('ChatInput.process_batch')
+    def process_batch(self, messages, vbox_console):
+        start_time = time.time()
+        actions = self.decode_batch(messages)
+
+        if messages:
+            self._latency.record(
+                'decode', (time.time() - start_time) / len(messages))
+
+        self.execute(actions, vbox_console)
+
+    @traced('ChatInput.decode_batch')
+    def decode_batch(self, messages):
+        '''Decode a list of ``(nick, message)`` pairs into actions.
+
+        Messages are decoded in order so the random choices and the mode
+        toggles come out the same as decoding them one at a time. Lowered
+        tokens are shared between the messages of the batch.
+
+        Messages can also be ``(nick, message, received_time)``. When
+        latency is being recorded, the time is copied to their actions.
+        '''
+        actions = []
+        lowered_cache = {}
+        keyword_tables = self._keyword_tables
+        stamp_actions = self._latency.enabled
+
+        for item in messages:
+            start_index = len(actions)
+
+            try:
+                self.decode(item[0], item[1], lowered_cache, actions,
+                            keyword_tables)
+            except (ValueError, KeyError, TypeError, IndexError):
+                _logger.exception('Error decoding input')
+
+            if stamp_actions and len(item) > 2:
+                for index in range(start_index, len(actions)):
+                    actions[index] = actions[index]._replace(
+                        received_time=item[2])
+
+        return actions
+
+    def decode(self, nick, message, lowered_cache=None, actions=None,
+               keyword_tables=None):
+        '''Decode a chat message into a list of actions.
+
+        The input counter and the mode toggles are updated as part of
+        decoding. The actions are run with :meth:`execute`. If `actions` is
+        given, the actions are appended to it.
+        '''
+        if actions is None:
+            actions = []
+
+        if keyword_tables is None:
+            keyword_tables = self._keyword_tables
+
         message = message.strip()
-        words = message.split()
-        lowered_words = list([word.lower() for word in words])
-        lowered_words_set = frozenset(lowered_words)
 
-        if not words:
-            return
+        if not message:
+            return actions
+
+        nick = nick.lower()
+        chat_data = self._chat_data
+        chat_data.reset(nick, message, lowered_cache)
+
+        if (self._input_counter % 2 == 0 or self._input_counter % 3 == 0) \
+                and not keyword_tables.emote_words.isdisjoint(
+                    chat_data.lowered_words_set):
+            if self._input_counter % 2 == 0:
+                self._is_key_input_state = not self._is_key_input_state
 
-        if lowered_words_set & EMOTE_WORDS and self._input_counter % 2 == 0:
-            self._is_key_input_state = not self._is_key_input_state
+            if self._input_counter % 3 == 0:
+                self._is_word_input_state = not self._is_word_input_state
 
-        if lowered_words_set & EMOTE_WORDS and self._input_counter % 3 == 0:
-            self._is_word_input_state = not self._is_word_input_state
+        if chat_data.first_word == '!move' and len(chat_data.words) >= 2:
+            chat_data.first_word = '!' + chat_data.words[1]
 
-        first_word = lowered_words[0]
+        # Only the first few letters without spaces are compared so a short
+        # prefix is lowered instead of the whole message when possible.
+        kapow_head = message[:16].lower().replace(' ', '')
 
-        if first_word == '!move' and len(words) >= 2:
-            first_word = '!' + words[1]
+        if len(kapow_head) < KAPOW_TRUNCATE_LENGTH and len(message) > 16:
+            kapow_head = message.lower().replace(' ', '')
 
-        chat_data = ChatData(nick, message, words, lowered_words,
-                             lowered_words_set, first_word)
+        rule_break_words = keyword_tables.rule_break_words
 
-        if message.lower().replace(' ', '')[:7] in KAPOW_WORDS_TRUNCATED or \
-                first_word.startswith('!kapow'):
-            self._logging.write_log(nick, 'CAD')
-            self._send_cad()
+        if kapow_head[:KAPOW_TRUNCATE_LENGTH] in \
+                keyword_tables.kapow_words_truncated or \
+                chat_data.first_word.startswith('!kapow'):
+            actions.append(Action(nick, 'CAD', self._send_cad, ()))
 
-        elif RULE_BREAK_WORDS & lowered_words_set and \
-                self._input_counter % len(RULE_BREAK_WORDS) == 0:
-            self._logging.write_log(nick, 'Reset')
-            self._reset_machine()
+        elif rule_break_words and \
+                self._input_counter % len(rule_break_words) == 0 and \
+                not rule_break_words.isdisjoint(chat_data.lowered_words_set):
+            actions.append(Action(nick, 'Reset', self._reset_machine, ()))
 
         elif self._is_key_input_state:
-            self._process_as_key_input(chat_data)
+            self._decode_key_input(chat_data, actions, keyword_tables)
 
         else:
-            self._process_as_mouse_input(chat_data)
+            self._decode_mouse_input(chat_data, actions, keyword_tables)
 
-        if self._is_word_input_state:
-            word = self._random.choice(words)[:32]
+        if self._is_word_input_state and not self._shedder.skip_words:
+            word = self._random.choice(chat_data.words)[:32]
             try:
                 word.encode('ascii')
             except UnicodeError:
                 pass
             else:
-                self._logging.write_log(nick, 'Word:{}'.format(word))
-                self._send_keys(word)
-                self._send_keys(' ')
+                actions.append(Action(nick, 'Word:{}'.format(word),
+                                      self._send_word, (word,)))
 
         self._input_counter += 1
 
-    def _process_as_key_input(self, chat_data):
-        key = None
-        modifier = None
-        first_input_combo = chat_data.first_word.split('+')[0]
+        return actions
 
-        if first_input_combo in INPUT_KEYS:
-            key = INPUT_KEYS[first_input_combo]
+    @traced('ChatInput.execute')
+    def execute(self, actions, vbox_console):
+        self._vbox_console = vbox_console
 
-        elif chat_data.first_word.startswith('@'):
-            self._send_key('ALT', down=True, up=False)
+        latency = self._latency
+
+        for action in actions:
+            if latency.enabled and action.received_time:
+                start_time = time.time()
+                dispatch_time = start_time - action.received_time
+                latency.record('dispatch', dispatch_time)
+            else:
+                dispatch_time = None
 
-            num = min(10, len(chat_data.first_word) - 1)
+            if action.log_value:
+                self._logging.write_log(action.nick, action.log_value,
+                                        dispatch_time)
 
-            self._logging.write_log(chat_data.nick, 'AltTab:{}'.format(num))
+            action.function(*action.args)
 
-            for dummy in range(num):
-                self._send_key('TAB')
+            if dispatch_time is not None:
+                latency.record('action', time.time() - start_time)
 
-            self._send_key('ALT', down=False, up=True)
+    def _decode_key_input(self, chat_data, actions, keyword_tables):
+        macro = None
+        log_value = None
+        first_input_combo = chat_data.first_word.split('+')[0]
+
+        if first_input_combo in keyword_tables.input_keys:
+            macro = log_value = keyword_tables.input_keys[first_input_combo]
+
+        elif chat_data.first_word.startswith('@'):
+            num = min(MAX_ALT_TAB, len(chat_data.first_word) - 1)
+            macro = ALT_TAB_MACROS[num]
+            log_value = 'AltTab:{}'.format(num)
 
         elif self._random.random() < 0.1 and \
-                frozenset(EXTRA_INPUT_KEYWORDS.keys()) & \
-                chat_data.lowered_words_set:
-            matches = frozenset(EXTRA_INPUT_KEYWORDS.keys()) \
-                & frozenset(chat_data.lowered_words)
+                not keyword_tables.extra_input_keywords_set.isdisjoint(
+                    chat_data.lowered_words_set):
+            matches = keyword_tables.extra_input_keywords_set & \
+                chat_data.lowered_words_set
             matches = list(matches)
             matches.sort()
 
-            key = EXTRA_INPUT_KEYWORDS[matches[0]]
-
-            if isinstance(key, list):
-                key, modifier = key
+            macro = keyword_tables.extra_input_keywords[matches[0]]
+            log_value = get_log_value(macro)
 
         elif self._random.random() < 0.1:
             if self._random.random() < 0.5:
                 key = self._random.choice(KEYS)
                 modifier = self._random.choice(KEY_MODIFIERS)
+                macro = '{}+{}'.format(modifier, key)
+                log_value = '{}+{}'.format(key, modifier)
             else:
-                key = self._random.choice(tuple(INPUT_KEYS.values()))
+                macro = log_value = self._random.choice(
+                    keyword_tables.input_keys_values)
 
-        if key and modifier:
-            self._logging.write_log(
-                chat_data.nick, '{}+{}'.format(key, modifier))
+        if macro:
+            program = keyword_tables.key_programs.get(macro, ())
+            actions.append(Action(chat_data.nick, log_value, self._run_program,
+                                  (program,)))
 
-            self._send_key(modifier, down=True, up=False)
-            self._send_key(key)
-            self._send_key(modifier, down=False, up=True)
-        elif key:
-            self._logging.write_log(chat_data.nick, key)
-            self._send_key(key)
-
-    def _process_as_mouse_input(self, chat_data):
+    def _decode_mouse_input(self, chat_data, actions, keyword_tables):
         first_word = chat_data.first_word
-        delta = int(self._random.uniform(0, MAX_MOUSE_MOVE_AMOUNT))
+        max_move_amount = keyword_tables.max_mouse_move_amount
+        delta = int(self._random.uniform(0, max_move_amount))
         delta_x = 0
         delta_y = 0
         left_click = False
@@ -304,7 +676,7 @@ class ChatInput(object):
 
             bet_team = chat_data.words[2]
             delta = random_value(bet_amount * len(chat_data.nick)) % \
-                (MAX_MOUSE_MOVE_AMOUNT * 2) - MAX_MOUSE_MOVE_AMOUNT
+                (max_move_amount * 2) - max_move_amount
 
             if bet_team == 'blue':
                 delta_x = delta
@@ -326,70 +698,87 @@ class ChatInput(object):
             else:
                 delta_x = delta
 
+        nick = chat_data.nick
+
         if delta_x != 0:
-            self._logging.write_log(chat_data.nick, 'XD:{}'.format(delta_x))
-            self._move_mouse(delta_x, 0)
+            actions.append(Action(nick, 'XD:{}'.format(delta_x),
+                                  self._move_mouse, (delta_x, 0)))
 
         if delta_y != 0:
-            self._logging.write_log(chat_data.nick, 'YD:{}'.format(delta_y))
-            self._move_mouse(0, delta_y)
+            actions.append(Action(nick, 'YD:{}'.format(delta_y),
+                                  self._move_mouse, (0, delta_y)))
 
         if left_click:
-            self._logging.write_log(chat_data.nick, 'LClick')
-            self._send_click(LEFT_BUTTON)
+            actions.append(Action(nick, 'LClick',
+                                  self._send_click, (LEFT_BUTTON,)))
 
         elif right_click:
-            self._logging.write_log(chat_data.nick, 'RClick')
-            self._send_click(RIGHT_BUTTON)
+            actions.append(Action(nick, 'RClick',
+                                  self._send_click, (RIGHT_BUTTON,)))
 
         elif drag:
-            self._logging.write_log(chat_data.nick, 'LMBDown')
-            self._send_mouse_down(LEFT_BUTTON)
+            actions.append(Action(nick, 'LMBDown',
+                                  self._send_mouse_down, (LEFT_BUTTON,)))
 
         elif drag_off:
-            self._logging.write_log(chat_data.nick, 'MBUp')
-            self._send_mouse_up()
+            actions.append(Action(nick, 'MBUp', self._send_mouse_up, ()))
 
         elif center:
-            self._logging.write_log(chat_data.nick, 'CenterXY')
-            self._center_mouse()
-
-    def _send_keys(self, keys_string):
-        for key_string in keys_string:
-            self._send_key(key_string)
+            actions.append(Action(nick, 'CenterXY', self._center_mouse, ()))
 
-    def _send_key(self, key_string, down=True, up=True):
-        if key_string not in SCANCODES:
-            _logger.debug('Ignored a key')
-            return
+    def _send_word(self, word):
+        self._run_program(compile_keys(word + ' '))
 
-        _logger.debug('Send key %s', key_string)
+    @traced('ChatInput._run_program')
+    def _run_program(self, program):
+        _logger.debug('Send key program of %d steps', len(program))
 
-        presses, releases = SCANCODES[key_string]
+        keyboard = self._vbox_console.keyboard
+        pacing = self._pacing
 
-        if down:
-            self._vbox_console.keyboard.put_scancodes(presses)
-            time.sleep(0.001)
+        for scancodes, delay in program:
+            start_time = time.time()
+            keyboard.put_scancodes(scancodes)
+            duration = time.time() - start_time
+            pacing.record_call('key', duration)
+            self._latency.record('key', duration)
 
-        if up:
-            self._vbox_console.keyboard.put_scancodes(releases)
-            time.sleep(0.001)
+            if delay is None:
+                self._sleep(pacing.key_delay)
+            else:
+                self._sleep(delay)
+
+    def _put_mouse_event(self, x, y, button_flags):
+        start_time = time.time()
+        self._vbox_console.mouse.put_mouse_event(x, y, 0, 0, button_flags)
+        duration = time.time() - start_time
+        self._pacing.record_call('mouse', duration)
+        self._latency.record('mouse', duration)
+
+    def _sleep(self, duration):
+        if self._latency.enabled:
+            start_time = time.time()
+            time.sleep(duration)
+            self._latency.record('sleep', time.time() - start_time)
+        else:
+            time.sleep(duration)
 
     def _send_click(self, button):
         self._send_mouse_down(button)
-        time.sleep(0.001)
+        self._sleep(self._pacing.click_delay)
         self._send_mouse_up()
 
     def _send_mouse_down(self, button):
         _logger.debug('Send button down %s', button)
-        self._vbox_console.mouse.put_mouse_event(0, 0, 0, 0, button)
+        self._put_mouse_event(0, 0, button)
         self._prev_button_flags = button
 
     def _send_mouse_up(self):
         _logger.debug('Send button up')
-        self._vbox_console.mouse.put_mouse_event(0, 0, 0, 0, 0)
+        self._put_mouse_event(0, 0, 0)
         self._prev_button_flags = 0
 
+    @traced('ChatInput._move_mouse')
     def _move_mouse(self, x, y, increment=10):
         _logger.debug('Request button move %d %d', x, y)
         accel_multiplier = 0.95
@@ -397,6 +786,7 @@ class ChatInput(object):
         multiplier_y = -1 if y < 0 else 1
         remain_x = abs(x)
         remain_y = abs(y)
+        increment *= self._shedder.mouse_increment_factor
 
         for dummy in range(1000):
             this_x = 0
@@ -416,10 +806,9 @@ class ChatInput(object):
             send_y = this_y * multiplier_y
             _logger.debug('Send button move %d %d', send_x, send_y)
 
-            self._vbox_console.mouse.put_mouse_event(
-                send_x, send_y, 0, 0, self._prev_button_flags)
+            self._put_mouse_event(send_x, send_y, self._prev_button_flags)
 
-            time.sleep(0.1)
+            self._sleep(self._pacing.mouse_step_delay)
 
             if remain_x <= 0 and remain_y <= 0:
                 break
@@ -438,6 +827,8 @@ class ChatInput(object):
 
     def _reset_machine(self):
         _logger.debug('Reset machine')
+        self._logging.persist_screenshots('reset')
+        events.publish('reset', reason='chat')
         self._vbox_console.reset()
 
 
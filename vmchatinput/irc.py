@@ -2,10 +2,12 @@ from __future__ import absolute_import
 
 import logging
 import random
-import threading
+import time
 import irc.client
 
 from six.moves import queue
+from vmchatinput import events, startup
+from vmchatinput.supervisor import HeartbeatThread
 
 
 _logger = logging.getLogger(__name__)
@@ -43,6 +45,7 @@ class Client(irc.client.SimpleIRCClient):
         self._running = False
 
     def on_welcome(self, connection, event):
+        startup.end('irc')
         self._reconnect_time = MIN_RECONNECT_TIME
         _logger.info('Joining channel %s', self._channel)
         connection.join(self._channel)
@@ -85,16 +88,17 @@ class Client(irc.client.SimpleIRCClient):
             message = message[7:-1]
 
         _logger.debug('Put message %s %s', nick, message)
+        events.publish('chat')
 
         try:
-            self._message_queue.put_nowait((nick, message))
+            self._message_queue.put_nowait((nick, message, time.time()))
         except queue.Full:
-            pass
+            events.publish('queue_drop')
 
 
-class IRCThread(threading.Thread):
+class IRCThread(HeartbeatThread):
     def __init__(self, message_queue, channel, irc_host, irc_port=6667):
-        threading.Thread.__init__(self)
+        HeartbeatThread.__init__(self)
         self._message_queue = message_queue
         self._channel = channel
         self._irc_host = irc_host
@@ -106,11 +110,13 @@ class IRCThread(threading.Thread):
         _logger.info('Starting IRC client.')
 
         self._running = True
+        startup.begin('irc')
         client = Client(self._channel, self._message_queue)
         client.connect(self._irc_host, self._irc_port, self.get_nickname())
 
         while self._running:
             client.reactor.process_once(0.2)
+            self.heartbeat()
 
         client.stop_autoconnect()
         client.reactor.disconnect_all()
@@ -0,0 +1,96 @@
+'''Histograms of the time a chat message spends in each stage.
+
+Stages are:
+
+* ``queue``: from receipt on the IRC socket until the VM thread takes the
+  message off the queue.
+* ``decode``: decoding, per message.
+* ``dispatch``: from receipt until an action of the message starts.
+* ``action``: running an action.
+* ``key`` and ``mouse``: one ``put_scancodes`` or ``put_mouse_event`` call.
+* ``sleep``: one sleep between input events.
+'''
+import logging
+
+
+_logger = logging.getLogger(__name__)
+
+STAGES = ('queue', 'decode', 'dispatch', 'action', 'key', 'mouse', 'sleep')
+NUM_BUCKETS = 32
+
+
+class Histogram(object):
+    '''Counts of durations in power of two buckets of microseconds.'''
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        bucket = min(NUM_BUCKETS - 1,
+                     max(0, int(duration * 1000000)).bit_length())
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, fraction):
+        '''Return the upper bound of the bucket holding the percentile.'''
+        if not self.count:
+            return 0.0
+
+        target = fraction * self.count
+        seen = 0
+
+        for bucket, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= target:
+                return min(self.max, (1 << bucket) / 1000000.0)
+
+        return self.max
+
+
+class LatencyRecorder(object):
+    '''Records stage durations into a :class:`Histogram` per stage.
+
+    When not enabled, nothing is recorded and the callers skip their extra
+    timing.
+    '''
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self.reset()
+
+    def reset(self):
+        self._histograms = dict((stage, Histogram()) for stage in STAGES)
+
+    def record(self, stage, duration):
+        if self.enabled:
+            self._histograms[stage].add(duration)
+
+    def get_histogram(self, stage):
+        return self._histograms[stage]
+
+    def format_report(self):
+        lines = ['{:<10} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+            'Stage', 'Count', 'Mean ms', 'p50 ms', 'p99 ms', 'Max ms')]
+
+        for stage in STAGES:
+            histogram = self._histograms[stage]
+
+            if not histogram.count:
+                continue
+
+            lines.append(
+                '{:<10} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+                    stage, histogram.count,
+                    histogram.total / histogram.count * 1000,
+                    histogram.percentile(0.5) * 1000,
+                    histogram.percentile(0.99) * 1000,
+                    histogram.max * 1000
+                )
+            )
+
+        return '\n'.join(lines)
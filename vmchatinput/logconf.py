@@ -0,0 +1,290 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+from logging.handlers import TimedRotatingFileHandler
+
+from six.moves import queue
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    QueueHandler = None
+    QueueListener = None
+
+
+_logger = logging.getLogger(__name__)
+
+LOG_QUEUE_SIZE = 10000
+DEBUG_RATE_LIMIT = 50
+LOG_FILENAME = 'log'
+STANDBY_LOG_FILENAME = 'log.standby'
+
+# The file handler and what holds it, so the log file can be switched.
+_file_logging = {}
+
+
+if not QueueHandler:
+    # Python 2 does not have these so a minimal version is provided. The
+    # records are prepared by DroppingQueueHandler.prepare.
+    class QueueHandler(logging.Handler):
+        def __init__(self, queue_):
+            logging.Handler.__init__(self)
+            self.queue = queue_
+
+        def enqueue(self, record):
+            self.queue.put_nowait(record)
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+    class QueueListener(object):
+        _sentinel = None
+
+        def __init__(self, queue_, *handlers):
+            self.queue = queue_
+            self.handlers = handlers
+            self._thread = None
+
+        def start(self):
+            self._thread = threading.Thread(target=self._monitor)
+            self._thread.daemon = True
+            self._thread.start()
+
+        def stop(self):
+            self.queue.put(self._sentinel)
+            self._thread.join()
+            self._thread = None
+
+        def _monitor(self):
+            while True:
+                record = self.queue.get()
+
+                if record is self._sentinel:
+                    break
+
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+
+
+class DroppingQueueHandler(QueueHandler):
+    '''Queue handler that drops debug records instead of blocking when full.
+
+    Records above debug level wait for room in the queue. The number of
+    dropped records is logged once the queue has room again.
+    '''
+    def __init__(self, queue_):
+        QueueHandler.__init__(self, queue_)
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # The message and traceback are formatted here because the listener
+        # formats records later, after the arguments may have changed.
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(
+                    record.exc_info)
+
+            record.exc_info = None
+
+        return record
+
+    def enqueue(self, record):
+        if record.levelno > logging.DEBUG:
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                return
+
+        if self.dropped != self._reported_dropped:
+            count = self.dropped - self._reported_dropped
+            self._reported_dropped = self.dropped
+            self.queue.put(_logger.makeRecord(
+                _logger.name, logging.WARNING, __file__, 0,
+                'Log queue was full. Dropped %d debug records.', (count,),
+                None
+            ))
+
+
+class SamplingFilter(logging.Filter):
+    '''Samples and rate limits debug records per call site.
+
+    `sample_rates` maps ``logger_name.function_name`` or ``logger_name`` to
+    the fraction of records to keep. Records are kept evenly, every Nth
+    one, instead of at random. `rate_limit` is the most records per second
+    kept from one call site. Records above debug level always pass.
+    '''
+    def __init__(self, sample_rates=None, rate_limit=None):
+        logging.Filter.__init__(self)
+        self._sample_intervals = dict(
+            (name, max(1, int(round(1 / rate))) if rate > 0 else 0)
+            for name, rate in (sample_rates or {}).items()
+        )
+        self._rate_limit = rate_limit
+        self._sample_counters = {}
+        self._rate_windows = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+
+        site = (record.name, record.funcName)
+
+        if self._sample_intervals and not self._sample(record, site):
+            return False
+
+        if self._rate_limit and not self._limit_rate(record, site):
+            return False
+
+        return True
+
+    def _sample(self, record, site):
+        interval = self._sample_intervals.get(
+            '{}.{}'.format(record.name, record.funcName),
+            self._sample_intervals.get(record.name)
+        )
+
+        if interval is None:
+            return True
+        elif interval == 0:
+            return False
+
+        count = self._sample_counters.get(site, 0)
+        self._sample_counters[site] = count + 1
+
+        return count % interval == 0
+
+    def _limit_rate(self, record, site):
+        second = int(record.created)
+        window_second, count = self._rate_windows.get(site, (None, 0))
+
+        if window_second != second:
+            count = 0
+
+        self._rate_windows[site] = (second, count + 1)
+
+        return count < self._rate_limit
+
+
+class JSONFormatter(logging.Formatter):
+    '''Formats records as one JSON object per line.'''
+    def format(self, record):
+        document = {
+            'time': datetime.datetime.utcfromtimestamp(record.created)
+            .isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'function': record.funcName,
+            'line': record.lineno,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+
+        # Records from the queue have their traceback in exc_text only.
+        exc_text = record.exc_text
+
+        if record.exc_info and not exc_text:
+            exc_text = self.formatException(record.exc_info)
+
+        if exc_text:
+            document['exception'] = exc_text
+
+        return json.dumps(document, sort_keys=True)
+
+
+def setup_logging(config, filename=LOG_FILENAME):
+    '''Log to the console and to a daily rotated file in the log directory.
+
+    A standby process logs to its own file because two processes rotating
+    the same file delete each other's rotated logs.
+    '''
+    if config.get('debug'):
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+
+    log_handler = _new_file_handler(config, filename, log_level)
+
+    console_handler.setLevel(log_level)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
+
+    _file_logging.update(config=config, level=log_level, handler=log_handler,
+                         listener=None)
+
+    if not config.get('log_queue', True):
+        root_logger.addHandler(console_handler)
+        root_logger.addHandler(log_handler)
+        return
+
+    # Formatting and writing happen in the listener thread so the input
+    # threads only pay for creating the record and queuing it.
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(
+        config.get('log_sample_rates'),
+        config.get('log_rate_limit', DEBUG_RATE_LIMIT)
+    ))
+    root_logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, console_handler, log_handler)
+    listener.start()
+    _file_logging['listener'] = listener
+
+    atexit.register(listener.stop)
+
+
+def set_log_filename(filename):
+    '''Switch logging to another file in the log directory.'''
+    old_handler = _file_logging['handler']
+    new_handler = _new_file_handler(_file_logging['config'], filename,
+                                    _file_logging['level'])
+    listener = _file_logging['listener']
+
+    if listener:
+        listener.handlers = tuple(
+            new_handler if handler is old_handler else handler
+            for handler in listener.handlers
+        )
+    else:
+        root_logger = logging.getLogger()
+        root_logger.addHandler(new_handler)
+        root_logger.removeHandler(old_handler)
+
+    _file_logging['handler'] = new_handler
+    old_handler.close()
+
+
+def _new_file_handler(config, filename, log_level):
+    log_handler = TimedRotatingFileHandler(
+        os.path.join(config['log_dir'], filename),
+        utc=True, when='midnight',
+    )
+
+    if config.get('log_structured'):
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    log_handler.setFormatter(formatter)
+    log_handler.setLevel(log_level)
+
+    return log_handler
@@ -0,0 +1,442 @@
+from __future__ import print_function, absolute_import
+
+import argparse
+import calendar
+import csv
+import datetime
+import io
+import logging
+import os
+import re
+import sqlite3
+import subprocess
+import time
+
+import six
+
+
+_logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = 'logindex.sqlite'
+INPUT_LOG_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})\.csv(\.xz)?$')
+INPUT_LOG_ARCHIVE_PATTERN = re.compile(r'^\d{4}-\d{2}\.csv\.xz$')
+SCREENSHOT_DIR_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+SCREENSHOT_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}T[\d:.]+?)(\.c)?\.png$')
+INSERT_BATCH_SIZE = 10000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS actions (
+    timestamp REAL NOT NULL,
+    nick TEXT NOT NULL,
+    value TEXT NOT NULL,
+    action TEXT NOT NULL,
+    hour INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS actions_timestamp ON actions (timestamp);
+CREATE INDEX IF NOT EXISTS actions_nick ON actions (nick, timestamp);
+CREATE INDEX IF NOT EXISTS actions_action ON actions (hour, action);
+CREATE TABLE IF NOT EXISTS screenshots (
+    timestamp REAL PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingested (
+    kind TEXT NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (kind, day)
+);
+CREATE TABLE IF NOT EXISTS archives (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL
+);
+'''
+
+
+def parse_timestamp(text):
+    if '.' in text:
+        datetime_ = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f')
+    else:
+        datetime_ = datetime.datetime.strptime(text, '%Y-%m-%dT%H:%M:%S')
+
+    return calendar.timegm(datetime_.timetuple()) + \
+        datetime_.microsecond / 1000000.0
+
+
+def format_timestamp(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).isoformat()
+
+
+class LogIndex(object):
+    '''Indexed copy of the input logs and screenshot times in SQLite.
+
+    Only days that have passed are ingested since the current day's log is
+    still being written. Each day is ingested once, so :meth:`update` only
+    reads the days closed since it last ran. Monthly archives of input logs
+    are read again when they grow, for days not ingested yet.
+    '''
+    def __init__(self, log_dir, path=None):
+        self._log_dir = log_dir
+        self._connection = sqlite3.connect(
+            path or os.path.join(log_dir, INDEX_FILENAME))
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def update(self):
+        date_today = datetime.datetime.utcnow().date().isoformat()
+        ingested = self._get_ingested()
+        filenames = sorted(os.listdir(self._log_dir))
+        filename_set = frozenset(filenames)
+
+        for filename in filenames:
+            match = INPUT_LOG_PATTERN.match(filename)
+
+            if match:
+                day = match.group(1)
+
+                # While xz runs, or after it fails, both the log and the
+                # partial compressed log exist. The uncompressed log is
+                # complete.
+                if match.group(2) and day + '.csv' in filename_set:
+                    continue
+
+                if day < date_today and ('actions', day) not in ingested:
+                    self._ingest_input_log(day, filename)
+                    ingested.add(('actions', day))
+
+            elif INPUT_LOG_ARCHIVE_PATTERN.match(filename):
+                size = os.path.getsize(os.path.join(self._log_dir, filename))
+
+                if self._get_archive_size(filename) != size:
+                    self._ingest_input_log_archive(filename, size, ingested)
+
+            elif SCREENSHOT_DIR_PATTERN.match(filename):
+                if ('screenshots', filename) not in ingested:
+                    self._ingest_screenshots(filename,
+                                             closed=filename < date_today)
+
+                    if filename < date_today:
+                        ingested.add(('screenshots', filename))
+
+    def _get_ingested(self):
+        return set(
+            self._connection.execute('SELECT kind, day FROM ingested'))
+
+    def _ingest_input_log(self, day, filename):
+        _logger.info('Indexing input log %s', filename)
+        start_time = time.time()
+        path = os.path.join(self._log_dir, filename)
+        count = 0
+
+        with self._connection:
+            rows = []
+
+            for row in read_input_log(path):
+                rows.append(row)
+
+                if len(rows) >= INSERT_BATCH_SIZE:
+                    self._insert_actions(rows)
+                    count += len(rows)
+                    rows = []
+
+            self._insert_actions(rows)
+            count += len(rows)
+
+            self._connection.execute(
+                'INSERT OR IGNORE INTO ingested (kind, day) VALUES (?, ?)',
+                ('actions', day))
+
+        _logger.info('Indexed %d actions in %.1f seconds',
+                     count, time.time() - start_time)
+
+    def _get_archive_size(self, filename):
+        row = self._connection.execute(
+            'SELECT size FROM archives WHERE name = ?', (filename,)
+        ).fetchone()
+
+        return row[0] if row else None
+
+    def _ingest_input_log_archive(self, filename, size, ingested):
+        _logger.info('Indexing input log archive %s', filename)
+        path = os.path.join(self._log_dir, filename)
+        day_strs = {}
+        new_days = set()
+
+        with self._connection:
+            rows = []
+
+            for row in read_input_log(path):
+                day_number = int(row[0] // 86400)
+                day = day_strs.get(day_number)
+
+                if not day:
+                    day = day_strs[day_number] = \
+                        format_timestamp(day_number * 86400)[:10]
+
+                if ('actions', day) in ingested:
+                    continue
+
+                new_days.add(day)
+                rows.append(row)
+
+                if len(rows) >= INSERT_BATCH_SIZE:
+                    self._insert_actions(rows)
+                    rows = []
+
+            self._insert_actions(rows)
+
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO ingested (kind, day) VALUES (?, ?)',
+                [('actions', day) for day in sorted(new_days)])
+            ingested.update(('actions', day) for day in new_days)
+            self._connection.execute(
+                'INSERT OR REPLACE INTO archives (name, size) VALUES (?, ?)',
+                (filename, size))
+
+        _logger.info('Indexed %d days from archive', len(new_days))
+
+    def _insert_actions(self, rows):
+        self._connection.executemany(
+            'INSERT INTO actions (timestamp, nick, value, action, hour) '
+            'VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+
+    def _ingest_screenshots(self, dir_name, closed):
+        rows = []
+
+        for filename in os.listdir(os.path.join(self._log_dir, dir_name)):
+            match = SCREENSHOT_PATTERN.match(filename)
+
+            if match:
+                rows.append((parse_timestamp(match.group(1)),
+                             dir_name + '/' + match.group(1)))
+
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO screenshots (timestamp, name) '
+                'VALUES (?, ?)',
+                rows
+            )
+
+            if closed:
+                self._connection.execute(
+                    'INSERT OR IGNORE INTO ingested (kind, day) '
+                    'VALUES (?, ?)',
+                    ('screenshots', dir_name))
+
+    def top_nicks(self, since=None, limit=10):
+        return self._connection.execute(
+            'SELECT nick, COUNT(*) AS count FROM actions '
+            'WHERE timestamp >= ? GROUP BY nick ORDER BY count DESC LIMIT ?',
+            (since or 0, limit)
+        ).fetchall()
+
+    def action_mix(self, since=None):
+        return self._connection.execute(
+            'SELECT hour, action, COUNT(*) FROM actions WHERE timestamp >= ? '
+            'GROUP BY hour, action ORDER BY hour, action',
+            (since or 0,)
+        ).fetchall()
+
+    def actions(self, nick=None, since=None, limit=100):
+        if nick:
+            return self._connection.execute(
+                'SELECT timestamp, nick, value FROM actions '
+                'WHERE nick = ? AND timestamp >= ? ORDER BY timestamp LIMIT ?',
+                (nick.lower(), since or 0, limit)
+            ).fetchall()
+        else:
+            return self._connection.execute(
+                'SELECT timestamp, nick, value FROM actions '
+                'WHERE timestamp >= ? ORDER BY timestamp LIMIT ?',
+                (since or 0, limit)
+            ).fetchall()
+
+    def nearest_screenshot(self, timestamp):
+        '''Return the path of the screenshot taken closest to the time.
+
+        Screenshots that no longer exist are skipped and their rows are
+        removed.
+        '''
+        before = self._connection.execute(
+            'SELECT timestamp, name FROM screenshots WHERE timestamp <= ? '
+            'ORDER BY timestamp DESC',
+            (timestamp,)
+        )
+        after = self._connection.execute(
+            'SELECT timestamp, name FROM screenshots WHERE timestamp > ? '
+            'ORDER BY timestamp',
+            (timestamp,)
+        )
+        before_row = before.fetchone()
+        after_row = after.fetchone()
+        missing_timestamps = []
+        path = None
+
+        # Search outward from the time, nearest first.
+        while before_row or after_row:
+            if not after_row or before_row and \
+                    timestamp - before_row[0] <= after_row[0] - timestamp:
+                row = before_row
+                before_row = before.fetchone()
+            else:
+                row = after_row
+                after_row = after.fetchone()
+
+            path = self._resolve_screenshot(row[1])
+
+            if path:
+                break
+
+            missing_timestamps.append((row[0],))
+
+        before.close()
+        after.close()
+
+        if missing_timestamps:
+            with self._connection:
+                self._connection.executemany(
+                    'DELETE FROM screenshots WHERE timestamp = ?',
+                    missing_timestamps)
+
+        return path
+
+    def forget_screenshots(self, names):
+        '''Remove the rows of deleted screenshots.
+
+        `names` are paths relative to the log directory of screenshot files
+        or of whole days of screenshots.
+        '''
+        timestamps = []
+        day_ranges = []
+
+        for name in names:
+            day, dummy, filename = name.partition('/')
+
+            if not filename:
+                day_start = parse_timestamp(day + 'T00:00:00')
+                day_ranges.append((day_start, day_start + 86400))
+                continue
+
+            match = SCREENSHOT_PATTERN.match(filename)
+
+            if match:
+                timestamps.append((parse_timestamp(match.group(1)),))
+
+        with self._connection:
+            self._connection.executemany(
+                'DELETE FROM screenshots WHERE timestamp = ?', timestamps)
+            self._connection.executemany(
+                'DELETE FROM screenshots WHERE timestamp >= ? '
+                'AND timestamp < ?', day_ranges)
+
+    def _resolve_screenshot(self, name):
+        # Screenshots are renamed once they are compressed.
+        for extension in ('.png', '.c.png'):
+            path = os.path.join(self._log_dir, name + extension)
+
+            if os.path.exists(path):
+                return path
+
+        # It was removed by the retention manager.
+        return None
+
+
+def read_input_log(path):
+    '''Yield action rows from a plain or xz compressed input log.'''
+    if path.endswith('.xz'):
+        proc = subprocess.Popen(['xz', '-dc', path], stdout=subprocess.PIPE)
+
+        if six.PY3:
+            file = io.TextIOWrapper(proc.stdout, encoding='utf-8',
+                                    errors='replace', newline='')
+        else:
+            file = proc.stdout
+    else:
+        proc = None
+
+        if six.PY3:
+            file = io.open(path, encoding='utf-8', errors='replace',
+                           newline='')
+        else:
+            file = open(path, 'rb')
+
+    try:
+        for row in csv.reader(file):
+            # Logs written with log_latency have a fourth column.
+            if len(row) < 3:
+                continue
+
+            datetime_str, nick, value = row[:3]
+
+            try:
+                timestamp = parse_timestamp(datetime_str)
+            except ValueError:
+                continue
+
+            yield (timestamp, nick, value, value.split(':', 1)[0],
+                   int(timestamp // 3600 % 24))
+    finally:
+        file.close()
+
+        if proc:
+            proc.wait()
+
+            if proc.returncode != 0:
+                raise Exception('xz exited abnormally: {}'
+                                .format(proc.returncode))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Query the input logs.')
+    arg_parser.add_argument('log_dir')
+    arg_parser.add_argument('--index', help='path of the index database')
+    arg_parser.add_argument('--no-update', action='store_true',
+                            help='do not index new logs before querying')
+    arg_parser.add_argument('--days', type=float,
+                            help='only include the last number of days')
+    subparsers = arg_parser.add_subparsers(dest='command')
+
+    subparsers.add_parser('update')
+    top_nicks_parser = subparsers.add_parser('top-nicks')
+    top_nicks_parser.add_argument('--limit', type=int, default=10)
+    subparsers.add_parser('action-mix')
+    actions_parser = subparsers.add_parser('actions')
+    actions_parser.add_argument('--nick')
+    actions_parser.add_argument('--limit', type=int, default=100)
+
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    log_index = LogIndex(args.log_dir, args.index)
+
+    if not args.no_update or args.command == 'update':
+        log_index.update()
+
+    if args.days:
+        since = time.time() - args.days * 86400
+    else:
+        since = None
+
+    if args.command == 'top-nicks':
+        for nick, count in log_index.top_nicks(since, args.limit):
+            print(count, nick)
+
+    elif args.command == 'action-mix':
+        for hour, action, count in log_index.action_mix(since):
+            print('{:02d} {} {}'.format(hour, action, count))
+
+    elif args.command == 'actions':
+        for timestamp, nick, value in log_index.actions(
+                args.nick, since, args.limit):
+            print(format_timestamp(timestamp), nick, value,
+                  log_index.nearest_screenshot(timestamp) or '')
+
+    log_index.close()
+
+
+if __name__ == '__main__':
+    main()
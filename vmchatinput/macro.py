@@ -0,0 +1,155 @@
+'''Key macros compiled into scancode programs.
+
+A macro is a string of chords separated by spaces. A chord is keys joined
+by ``+``: the last key is pressed while the keys before it are held down.
+A chord can end with ``*N`` to press the last key N times and ``~SECONDS``
+to hold it down. Key names are the names in ``SCANCODES``. Examples::
+
+    ALT+F4
+    CTRL+ALT+E_DEL
+    ALT+TAB*3
+    E_UP~0.5
+    LWIN E_UP ENTER
+
+A program is a tuple of ``(scancodes, delay)`` steps. Each step is sent
+with a single ``put_scancodes`` call and followed by the delay. A delay of
+``None`` is the usual delay between keys which is chosen when the program
+runs.
+'''
+import logging
+import re
+
+from virtualbox.library_ext.keyboard import SCANCODES
+
+
+_logger = logging.getLogger(__name__)
+
+MAX_REPEAT = 100
+MAX_HOLD = 10
+CHORD_PATTERN = re.compile(
+    r'^(?P<keys>[^*~]+)(?:\*(?P<repeat>\d+))?(?:~(?P<hold>[\d.]+))?$'
+)
+
+
+class MacroError(ValueError):
+    pass
+
+
+def parse_chord(text):
+    '''Return the keys, repeat count, and hold time of a chord.'''
+    match = CHORD_PATTERN.match(text)
+
+    if not match:
+        raise MacroError('Bad chord {}'.format(text))
+
+    keys = match.group('keys').split('+')
+    repeat = int(match.group('repeat') or 1)
+
+    try:
+        hold = float(match.group('hold') or 0)
+    except ValueError:
+        raise MacroError('Bad hold time in chord {}'.format(text))
+
+    if not all(keys):
+        raise MacroError('Empty key in chord {}'.format(text))
+
+    if repeat > MAX_REPEAT:
+        raise MacroError('Too many repeats in chord {}'.format(text))
+
+    if hold > MAX_HOLD:
+        raise MacroError('Hold too long in chord {}'.format(text))
+
+    return keys, repeat, hold
+
+
+def compile_chord(keys, repeat=1, hold=0, scancodes=SCANCODES):
+    for key in keys:
+        if key not in scancodes:
+            raise MacroError('Unknown key {}'.format(key))
+
+    modifiers = keys[:-1]
+    key = keys[-1]
+    presses, releases = scancodes[key]
+    modifier_presses = []
+    modifier_releases = []
+
+    for modifier in modifiers:
+        modifier_presses.extend(scancodes[modifier][0])
+
+    for modifier in reversed(modifiers):
+        modifier_releases.extend(scancodes[modifier][1])
+
+    key_delay = hold or None
+
+    if repeat == 0:
+        return ((modifier_presses, None), (modifier_releases, None))
+
+    steps = [(modifier_presses + list(presses), key_delay)]
+
+    for dummy in range(repeat - 1):
+        steps.append((list(releases), None))
+        steps.append((list(presses), key_delay))
+
+    steps.append((list(releases) + modifier_releases, None))
+
+    return tuple(steps)
+
+
+def compile_macro(spec, scancodes=SCANCODES):
+    chords = spec.split()
+
+    if not chords:
+        raise MacroError('Empty macro')
+
+    program = ()
+
+    for chord in chords:
+        keys, repeat, hold = parse_chord(chord)
+        program += compile_chord(keys, repeat, hold, scancodes)
+
+    return program
+
+
+def compile_table(specs, scancodes=SCANCODES):
+    '''Compile macros into a dict of macro to program.
+
+    Macros that do not compile are logged and left out.
+    '''
+    programs = {}
+
+    for spec in specs:
+        try:
+            programs[spec] = compile_macro(spec, scancodes)
+        except MacroError as error:
+            _logger.warning('Ignored macro %s: %s', spec, error)
+
+    return programs
+
+
+def compile_keys(text, scancodes=SCANCODES):
+    '''Compile typing a string, one key per character.
+
+    Characters without a scancode are skipped.
+    '''
+    steps = []
+
+    for key in text:
+        if key in scancodes:
+            presses, releases = scancodes[key]
+            steps.append((list(presses), None))
+            steps.append((list(releases), None))
+
+    return tuple(steps)
+
+
+def get_log_value(spec):
+    '''Return how a macro is written in the input log.
+
+    A single chord is written with the key first followed by its modifiers
+    (``F4+ALT``) as it was before macros.
+    '''
+    if ' ' not in spec and '*' not in spec and '~' not in spec:
+        keys = spec.split('+')
+        return '+'.join([keys[-1]] + keys[:-1])
+
+    return spec
@@ -0,0 +1,117 @@
+import logging
+
+
+_logger = logging.getLogger(__name__)
+
+KEY_DELAY = 0.001
+CLICK_DELAY = 0.001
+MOUSE_STEP_DELAY = 0.1
+SLOW_CALL_TIME = 0.02
+SLOW_CALL_FACTOR = 4
+CALL_TIME_SMOOTHING = 0.05
+
+
+class AIMDDelay(object):
+    '''Delay between input events adjusted additive-increase,
+    multiplicative-decrease style on the input rate.
+
+    Every sign that the guest keeps up shortens the delay by a small fixed
+    step. Every sign of congestion doubles it. The delay stays within the
+    bounds.
+    '''
+    def __init__(self, initial, minimum, maximum, step):
+        assert minimum <= initial <= maximum
+        self.value = initial
+        self._initial = initial
+        self._minimum = minimum
+        self._maximum = maximum
+        self._step = step
+
+    def increase_rate(self):
+        self.value = max(self._minimum, self.value - self._step)
+
+    def decrease_rate(self):
+        self.value = min(self._maximum, self.value * 2)
+
+    def reset(self):
+        self.value = self._initial
+
+
+class PacingController(object):
+    '''Chooses the delays between key, click, and mouse events.
+
+    When not adaptive, the delays are the fixed defaults. When adaptive, the
+    delays of each :class:`AIMDDelay` shrink only when the screen changed
+    between screenshots, the one sign that the guest applies the input. They
+    grow when the screen stops changing or a VirtualBox call is slow. The
+    calls only hand input to VirtualBox so a fast call says little about the
+    guest. The minimums are half the fixed defaults.
+    '''
+    def __init__(self, adaptive=False):
+        self._adaptive = adaptive
+        self._key = AIMDDelay(KEY_DELAY, KEY_DELAY / 2, 0.02, 0.0001)
+        self._click = AIMDDelay(CLICK_DELAY, CLICK_DELAY / 2, 0.02, 0.0001)
+        self._mouse_step = AIMDDelay(MOUSE_STEP_DELAY, MOUSE_STEP_DELAY / 2,
+                                     0.2, 0.005)
+        self._call_time = {}
+
+    @property
+    def key_delay(self):
+        return self._key.value
+
+    @property
+    def click_delay(self):
+        return self._click.value
+
+    @property
+    def mouse_step_delay(self):
+        return self._mouse_step.value
+
+    def record_call(self, kind, duration):
+        '''Record how long a ``'key'`` or ``'mouse'`` call took.'''
+        if not self._adaptive:
+            return
+
+        average = self._call_time.get(kind, duration)
+        self._call_time[kind] = average + \
+            (duration - average) * CALL_TIME_SMOOTHING
+
+        if duration > max(SLOW_CALL_TIME, average * SLOW_CALL_FACTOR):
+            _logger.debug('Slow %s call %.3f. Backing off.', kind, duration)
+
+            for delay in self._get_delays(kind):
+                delay.decrease_rate()
+
+    def record_screen_change(self, changed):
+        '''Record whether the screen changed since the last screenshot.
+
+        A changed screen shows the guest is applying the input. An
+        unchanged screen after many inputs suggests it is dropping them.
+        '''
+        if not self._adaptive:
+            return
+
+        if changed:
+            for delay in (self._key, self._click, self._mouse_step):
+                delay.increase_rate()
+        else:
+            _logger.debug('Screen unchanged. Backing off.')
+
+            for delay in (self._key, self._click, self._mouse_step):
+                delay.decrease_rate()
+
+    def reset(self):
+        '''Return to the initial delays, such as after the machine is reset.
+
+        The delays learned before then describe a guest that is gone.
+        '''
+        for delay in (self._key, self._click, self._mouse_step):
+            delay.reset()
+
+        self._call_time = {}
+
+    def _get_delays(self, kind):
+        if kind == 'key':
+            return (self._key,)
+        else:
+            return (self._click, self._mouse_step)
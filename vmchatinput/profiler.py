@@ -0,0 +1,167 @@
+from __future__ import absolute_import
+
+import collections
+import datetime
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+
+_logger = logging.getLogger(__name__)
+
+_tracing_enabled = False
+_span_lock = threading.Lock()
+_span_stats = {}
+_profiler = None
+
+
+def set_tracing(enabled):
+    global _tracing_enabled
+    _tracing_enabled = enabled
+
+
+def is_tracing():
+    return _tracing_enabled
+
+
+def traced(name):
+    '''Decorator that records the duration of calls while tracing is on.
+
+    When tracing is off, the only overhead is a global lookup.
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _tracing_enabled:
+                return func(*args, **kwargs)
+
+            start_time = time.time()
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record_span(name, time.time() - start_time)
+
+        return wrapper
+
+    return decorator
+
+
+def _record_span(name, duration):
+    with _span_lock:
+        stats = _span_stats.get(name)
+
+        if stats:
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+        else:
+            _span_stats[name] = [1, duration, duration]
+
+
+def pop_span_stats():
+    '''Return and reset the span stats as ``{name: (count, total, max)}``.'''
+    global _span_stats
+
+    with _span_lock:
+        stats = _span_stats
+        _span_stats = {}
+
+    return dict((name, tuple(values)) for name, values in stats.items())
+
+
+def start_profiler(log_dir, duration=30):
+    global _profiler
+
+    if _profiler and _profiler.is_alive():
+        _logger.warning('Profiler is already running.')
+        return
+
+    _profiler = SamplingProfiler(log_dir, duration)
+    _profiler.start()
+
+
+class SamplingProfiler(threading.Thread):
+    '''Samples the stacks of all threads for a period of time.
+
+    The samples are written to ``log_dir`` in the collapsed stack format
+    used by flamegraph.pl. Span tracing is switched on for the duration of
+    the profile and the span stats are written next to the samples.
+    '''
+    def __init__(self, log_dir, duration=30, interval=0.005):
+        threading.Thread.__init__(self)
+        self._log_dir = log_dir
+        self._duration = duration
+        self._interval = interval
+        self.daemon = True
+
+    def run(self):
+        _logger.info('Profiling for %d seconds.', self._duration)
+
+        was_tracing = is_tracing()
+        set_tracing(True)
+
+        try:
+            counts = self._sample()
+        finally:
+            set_tracing(was_tracing)
+
+        path = self._get_path()
+        self._write_samples(path + '.folded', counts)
+        self._write_spans(path + '.spans.txt', pop_span_stats())
+
+        _logger.info('Profile written to %s', path)
+
+    def _sample(self):
+        counts = collections.Counter()
+        own_ident = threading.current_thread().ident
+        end_time = time.time() + self._duration
+
+        while time.time() < end_time:
+            thread_names = dict(
+                (thread.ident, thread.__class__.__name__)
+                for thread in threading.enumerate()
+            )
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+
+                stack = []
+
+                while frame:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+
+                stack.append(thread_names.get(ident, str(ident)))
+                stack.reverse()
+
+                counts[';'.join(stack)] += 1
+
+            time.sleep(self._interval)
+
+        return counts
+
+    def _get_path(self):
+        datetime_str = datetime.datetime.utcnow().isoformat()
+        return os.path.join(self._log_dir, 'profile-' + datetime_str)
+
+    def _write_samples(self, path, counts):
+        with open(path, 'w') as file:
+            for stack, count in sorted(counts.items()):
+                file.write('{} {}\n'.format(stack, count))
+
+    def _write_spans(self, path, span_stats):
+        with open(path, 'w') as file:
+            file.write('name count total_ms mean_ms max_ms\n')
+
+            for name, (count, total, maximum) in sorted(span_stats.items()):
+                file.write('{} {} {:.3f} {:.3f} {:.3f}\n'.format(
+                    name, count, total * 1000, total / count * 1000,
+                    maximum * 1000
+                ))
@@ -0,0 +1,334 @@
+'''Tiered retention of the log directory within a storage budget.
+
+Files in the log directory age through these tiers:
+
+* Screenshots are kept as taken for `screenshot_full_days` days. Older
+  days are thinned to one frame per `screenshot_sample_interval` seconds.
+* Daily input logs are compressed by :class:`CompressThread`. After
+  `input_log_archive_days` days, they are appended to a monthly
+  ``YYYY-MM.csv.xz`` archive. Concatenated xz streams decompress as one
+  file so the archive never has to be recompressed.
+* Once the screenshots, input logs, and program logs take more than
+  `storage_budget` bytes, the oldest days are deleted until they fit.
+  Other files, such as the log index, are not counted.
+
+A tier without a setting is skipped. The current day is never touched.
+'''
+import datetime
+import logging
+import os
+import re
+import shutil
+
+
+_logger = logging.getLogger(__name__)
+
+SCREENSHOT_SAMPLE_INTERVAL = 3600
+DAY_DIR_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})$')
+DAILY_INPUT_LOG_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})\.csv(\.xz)?$')
+MONTHLY_INPUT_LOG_PATTERN = re.compile(r'^(\d{4}-\d{2})\.csv\.xz$')
+PROGRAM_LOG_PATTERN = re.compile(
+    r'^log(?:\.standby)?\.(\d{4}-\d{2}-\d{2})(\.xz)?$')
+SCREENSHOT_PATTERN = re.compile(
+    r'^\d{4}-\d{2}-\d{2}T(\d{2}):(\d{2}):(\d{2})[\d.]*(\.c)?\.png$')
+MANAGED_PATTERNS = (DAY_DIR_PATTERN, DAILY_INPUT_LOG_PATTERN,
+                    MONTHLY_INPUT_LOG_PATTERN, PROGRAM_LOG_PATTERN)
+ARCHIVE_JOURNAL_SUFFIX = '.journal'
+
+
+class StorageUsage(object):
+    '''Size of each entry at the top of the log directory that retention
+    manages.
+
+    A directory is only walked again when its modification time changes,
+    which happens when files are added, removed, or renamed in it. Files
+    are just stat'ed. So after the first pass, only the current day is
+    walked.
+    '''
+    def __init__(self, log_dir):
+        self._log_dir = log_dir
+        self._entries = {}
+
+    @property
+    def total(self):
+        return sum(size for dummy, size in self._entries.values())
+
+    def update(self):
+        names = frozenset(name for name in os.listdir(self._log_dir)
+                          if is_managed(name))
+
+        for name in tuple(self._entries):
+            if name not in names:
+                del self._entries[name]
+
+        for name in names:
+            path = os.path.join(self._log_dir, name)
+
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                self._entries.pop(name, None)
+                continue
+
+            if not os.path.isdir(path):
+                self._entries[name] = (stat_result.st_mtime,
+                                       stat_result.st_size)
+            elif self._entries.get(name, (None,))[0] != stat_result.st_mtime:
+                self._entries[name] = (stat_result.st_mtime,
+                                       get_dir_size(path))
+
+    def forget(self, name):
+        self._entries.pop(name, None)
+
+
+class RetentionManager(object):
+    '''Applies the retention tiers to a log directory.
+
+    Call :meth:`run` periodically. It is run by :class:`CompressThread`
+    after compressing.
+    '''
+    def __init__(self, log_dir, screenshot_full_days=None,
+                 screenshot_sample_interval=SCREENSHOT_SAMPLE_INTERVAL,
+                 input_log_archive_days=None, storage_budget=None):
+        self._log_dir = log_dir
+        self._screenshot_full_days = screenshot_full_days
+        self._screenshot_sample_interval = screenshot_sample_interval
+        self._input_log_archive_days = input_log_archive_days
+        self._storage_budget = storage_budget
+        self._usage = StorageUsage(log_dir)
+        self._thinned_dirs = {}
+
+    @property
+    def usage(self):
+        return self._usage
+
+    def run(self, heartbeat=None):
+        '''Apply the tiers.
+
+        Returns the screenshot files and days of screenshots removed, as
+        paths relative to the log directory.
+        '''
+        heartbeat = heartbeat or (lambda: None)
+        date_today = datetime.datetime.utcnow().date()
+        removed_screenshots = []
+
+        if self._screenshot_full_days is not None:
+            self._thin_screenshots(
+                date_today - datetime.timedelta(self._screenshot_full_days),
+                heartbeat, removed_screenshots
+            )
+
+        if self._input_log_archive_days is not None:
+            self._archive_input_logs(
+                date_today - datetime.timedelta(self._input_log_archive_days),
+                heartbeat
+            )
+
+        self._usage.update()
+
+        if self._storage_budget is not None:
+            self._evict(date_today, heartbeat, removed_screenshots)
+
+        return removed_screenshots
+
+    def _thin_screenshots(self, before_date, heartbeat, removed_screenshots):
+        before_str = before_date.isoformat()
+
+        for name in sorted(os.listdir(self._log_dir)):
+            if not DAY_DIR_PATTERN.match(name) or name >= before_str:
+                continue
+
+            path = os.path.join(self._log_dir, name)
+
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+
+            if self._thinned_dirs.get(name) == mtime:
+                continue
+
+            heartbeat()
+            removed_screenshots.extend(
+                name + '/' + filename
+                for filename in self._thin_screenshot_dir(path))
+            self._thinned_dirs[name] = os.path.getmtime(path)
+
+    def _thin_screenshot_dir(self, path):
+        kept_slots = set()
+        removed = []
+
+        for filename in sorted(os.listdir(path)):
+            match = SCREENSHOT_PATTERN.match(filename)
+
+            if not match:
+                continue
+
+            hours, minutes, seconds = match.groups()[:3]
+            slot = (int(hours) * 3600 + int(minutes) * 60 + int(seconds)) \
+                // self._screenshot_sample_interval
+
+            if slot in kept_slots:
+                os.remove(os.path.join(path, filename))
+                removed.append(filename)
+            else:
+                kept_slots.add(slot)
+
+        if removed:
+            _logger.info('Thinned %d screenshots in %s', len(removed), path)
+
+        return removed
+
+    def _archive_input_logs(self, before_date, heartbeat):
+        before_str = before_date.isoformat()
+
+        for name in os.listdir(self._log_dir):
+            if name.endswith(ARCHIVE_JOURNAL_SUFFIX):
+                self._recover_archive(name)
+
+        for name in sorted(os.listdir(self._log_dir)):
+            match = DAILY_INPUT_LOG_PATTERN.match(name)
+
+            # Only compressed logs are archived. The others are left for
+            # the compress pass.
+            if not match or not match.group(2) or match.group(1) >= before_str:
+                continue
+
+            heartbeat()
+            self._append_to_archive(name, match.group(1)[:7])
+
+    def _append_to_archive(self, name, month):
+        path = os.path.join(self._log_dir, name)
+        archive_path = os.path.join(self._log_dir, month + '.csv.xz')
+        journal_path = archive_path + ARCHIVE_JOURNAL_SUFFIX
+
+        _logger.info('Archiving input log %s to %s', name, archive_path)
+
+        # The journal records the archive size before the append so an
+        # append interrupted before the daily log is removed can be undone.
+        if os.path.exists(archive_path):
+            archive_size = os.path.getsize(archive_path)
+        else:
+            archive_size = 0
+
+        write_synced(journal_path, '{} {}'.format(name, archive_size))
+
+        with open(archive_path, 'ab') as archive_file:
+            with open(path, 'rb') as file:
+                shutil.copyfileobj(file, archive_file)
+
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+        os.remove(path)
+        os.remove(journal_path)
+
+    def _recover_archive(self, journal_name):
+        journal_path = os.path.join(self._log_dir, journal_name)
+        archive_path = journal_path[:-len(ARCHIVE_JOURNAL_SUFFIX)]
+
+        with open(journal_path) as file:
+            name, archive_size = file.read().split()
+
+        if os.path.exists(os.path.join(self._log_dir, name)) and \
+                os.path.exists(archive_path):
+            _logger.warning('Undoing interrupted archiving of %s', name)
+
+            with open(archive_path, 'r+b') as archive_file:
+                archive_file.truncate(int(archive_size))
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+
+        os.remove(journal_path)
+
+    def _evict(self, date_today, heartbeat, removed_screenshots):
+        date_today_str = date_today.isoformat()
+        month_today_str = date_today_str[:7]
+        candidates = []
+
+        for name in os.listdir(self._log_dir):
+            match = DAY_DIR_PATTERN.match(name)
+
+            if match:
+                candidates.append((match.group(1), 0, name))
+                continue
+
+            match = PROGRAM_LOG_PATTERN.match(name)
+
+            if match:
+                candidates.append((match.group(1), 1, name))
+                continue
+
+            match = DAILY_INPUT_LOG_PATTERN.match(name)
+
+            if match:
+                candidates.append((match.group(1), 2, name))
+                continue
+
+            match = MONTHLY_INPUT_LOG_PATTERN.match(name)
+
+            if match and match.group(1) != month_today_str:
+                # Sorted as the last day of the month.
+                candidates.append((match.group(1) + '-99', 2, name))
+
+        # Screenshots go first, then program logs, then input logs of the
+        # same day.
+        candidates.sort()
+
+        for day, dummy, name in candidates:
+            if self._usage.total <= self._storage_budget:
+                break
+
+            if day >= date_today_str:
+                break
+
+            heartbeat()
+            self._delete(name)
+
+            if DAY_DIR_PATTERN.match(name):
+                removed_screenshots.append(name)
+
+    def _delete(self, name):
+        path = os.path.join(self._log_dir, name)
+        _logger.info('Over storage budget. Deleting %s', path)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+        self._usage.forget(name)
+        self._thinned_dirs.pop(name, None)
+
+
+def is_managed(name):
+    return any(pattern.match(name) for pattern in MANAGED_PATTERNS)
+
+
+def write_synced(path, text):
+    with open(path, 'w') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def get_dir_size(path):
+    '''Return the total size of the files in a directory tree.
+
+    Hard links, as made by the deduplication, are counted once.
+    '''
+    inodes = set()
+    size = 0
+
+    for dir_path, dummy, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                stat_result = os.lstat(os.path.join(dir_path, filename))
+            except OSError:
+                continue
+
+            if stat_result.st_ino not in inodes:
+                inodes.add(stat_result.st_ino)
+                size += stat_result.st_size
+
+    return size
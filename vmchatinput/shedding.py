@@ -0,0 +1,119 @@
+import logging
+import time
+
+from vmchatinput import events
+
+
+_logger = logging.getLogger(__name__)
+
+LEVEL_NORMAL = 0
+LEVEL_SKIP_WORDS = 1
+LEVEL_SHORT_MOUSE = 2
+LEVEL_DROP_STALE = 3
+LEVEL_SAMPLE = 4
+LEVEL_NAMES = ('normal', 'skip words', 'short mouse moves', 'drop stale',
+               'sample')
+LEVEL_CHANGE_INTERVAL = 1
+RECOVER_FACTOR = 0.5
+COST_SMOOTHING = 0.1
+SHORT_MOUSE_INCREMENT_FACTOR = 4
+SAMPLE_INTERVAL = 2
+
+
+class LoadShedder(object):
+    '''Degrades the input in steps to keep the input latency under the SLO.
+
+    The expected latency is the age of the oldest message in a batch plus
+    the time to execute the batch and the messages still queued, estimated
+    from the average time a message takes. While it is over `latency_slo`,
+    the level goes up one step per second: word typing is skipped, mouse
+    moves take fewer larger steps, messages older than `latency_slo` are
+    dropped, and then only every other message is kept. The level goes down
+    the same way once the latency falls below half the SLO.
+
+    Messages are ``(nick, message, received_time)`` tuples. Without a
+    `latency_slo`, nothing is shed.
+    '''
+    def __init__(self, latency_slo=None):
+        self._latency_slo = latency_slo
+        self._level = LEVEL_NORMAL
+        self._level_change_time = 0
+        self._message_cost = 0.0
+        self._sample_counter = 0
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def skip_words(self):
+        return self._level >= LEVEL_SKIP_WORDS
+
+    @property
+    def mouse_increment_factor(self):
+        if self._level >= LEVEL_SHORT_MOUSE:
+            return SHORT_MOUSE_INCREMENT_FACTOR
+        else:
+            return 1
+
+    def filter_batch(self, messages, queue_size=0, now=None):
+        '''Update the level and return the messages to keep.'''
+        if not self._latency_slo or not messages:
+            return messages
+
+        if now is None:
+            now = time.time()
+
+        oldest_age = now - messages[0][2]
+        latency = oldest_age + \
+            (len(messages) + queue_size) * self._message_cost
+
+        self._update_level(latency, now)
+
+        if self._level < LEVEL_DROP_STALE:
+            return messages
+
+        deadline = now - self._latency_slo
+        kept_messages = []
+
+        for message in messages:
+            if message[2] < deadline:
+                continue
+
+            if self._level >= LEVEL_SAMPLE:
+                self._sample_counter += 1
+
+                if self._sample_counter % SAMPLE_INTERVAL:
+                    continue
+
+            kept_messages.append(message)
+
+        for dummy in range(len(messages) - len(kept_messages)):
+            events.publish('shed_drop')
+
+        return kept_messages
+
+    def record_batch(self, message_count, duration):
+        '''Record how long executing a batch of messages took.'''
+        if not message_count:
+            return
+
+        cost = duration / message_count
+        self._message_cost += (cost - self._message_cost) * COST_SMOOTHING
+
+    def _update_level(self, latency, now):
+        if now - self._level_change_time < LEVEL_CHANGE_INTERVAL:
+            return
+
+        if latency > self._latency_slo and self._level < LEVEL_SAMPLE:
+            self._set_level(self._level + 1, latency, now)
+        elif latency < self._latency_slo * RECOVER_FACTOR and \
+                self._level > LEVEL_NORMAL:
+            self._set_level(self._level - 1, latency, now)
+
+    def _set_level(self, level, latency, now):
+        _logger.info('Load shedding level %s (latency %.2f)',
+                     LEVEL_NAMES[level], latency)
+        self._level = level
+        self._level_change_time = now
+        events.publish('shed_level', level=level)
@@ -0,0 +1,64 @@
+import collections
+import contextlib
+import threading
+import time
+
+
+_start_time = time.time()
+_lock = threading.Lock()
+_phases = collections.OrderedDict()
+
+
+def begin(name):
+    with _lock:
+        if name not in _phases:
+            _phases[name] = [time.time(), None]
+
+
+def end(name):
+    with _lock:
+        times = _phases.get(name)
+
+        if times and times[1] is None:
+            times[1] = time.time()
+
+
+@contextlib.contextmanager
+def phase(name):
+    begin(name)
+
+    try:
+        yield
+    finally:
+        end(name)
+
+
+def is_done(*names):
+    with _lock:
+        return all(
+            name in _phases and _phases[name][1] is not None
+            for name in names
+        )
+
+
+def format_report():
+    '''Return a table of the start, end and duration of each phase.
+
+    Times are relative to when this module was first imported. Phases run
+    in different threads overlap so the durations do not add up to the
+    total.
+    '''
+    lines = ['{:<20} {:>8} {:>8} {:>8}'.format(
+        'phase', 'start', 'end', 'duration')]
+
+    with _lock:
+        for name, (start_time, end_time) in _phases.items():
+            if end_time is None:
+                lines.append('{:<20} {:>8.3f} {:>8} {:>8}'.format(
+                    name, start_time - _start_time, '-', '-'))
+            else:
+                lines.append('{:<20} {:>8.3f} {:>8.3f} {:>8.3f}'.format(
+                    name, start_time - _start_time, end_time - _start_time,
+                    end_time - start_time))
+
+    return '\n'.join(lines)
@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+import threading
+
+
+_logger = logging.getLogger(__name__)
+
+STATE_FILENAME = 'state.json'
+STATE_SAVE_INTERVAL = 10
+
+
+class StateStore(threading.Thread):
+    '''Checkpoints a state snapshot to a JSON file in the background.
+
+    :meth:`update` only keeps a reference to the snapshot so it is cheap to
+    call often. The snapshot is written every `interval` seconds, if it
+    changed, and when stopped. Writes go to a temporary file that is renamed
+    over the state file so a crash leaves either the old or the new state.
+    '''
+    def __init__(self, log_dir, interval=STATE_SAVE_INTERVAL):
+        threading.Thread.__init__(self)
+        self._path = os.path.join(log_dir, STATE_FILENAME)
+        # Each store has its own temporary file so a store that is still
+        # stopping does not write into the file of its replacement.
+        self._temp_path = '{}.{}.{}.tmp'.format(self._path, os.getpid(),
+                                                id(self))
+        self._interval = interval
+        self._snapshot = None
+        self._written_snapshot = None
+        self._stop_event = threading.Event()
+        self._running = False
+        self.daemon = True
+
+    def load(self):
+        '''Return the saved snapshot or None.'''
+        try:
+            with open(self._path) as file:
+                return json.load(file)
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            _logger.exception('Bad state file %s', self._path)
+            return None
+
+    def update(self, snapshot):
+        self._snapshot = snapshot
+
+    def run(self):
+        self._running = True
+
+        while self._running:
+            self._stop_event.wait(self._interval)
+            self._save()
+
+    def stop(self):
+        self._running = False
+        self._stop_event.set()
+
+        if self.is_alive():
+            self.join()
+        else:
+            self._save()
+
+    def _save(self):
+        snapshot = self._snapshot
+
+        if snapshot is None or snapshot is self._written_snapshot:
+            return
+
+        temp_path = self._temp_path
+
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(snapshot, file)
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.rename(temp_path, self._path)
+        except (IOError, OSError):
+            _logger.exception('Failed to save state')
+        else:
+            self._written_snapshot = snapshot
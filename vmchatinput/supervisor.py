@@ -0,0 +1,115 @@
+import collections
+import logging
+import threading
+import time
+
+from vmchatinput import events
+
+
+_logger = logging.getLogger(__name__)
+
+MAX_RESTARTS = 5
+RESTART_WINDOW = 600
+
+
+class HeartbeatThread(threading.Thread):
+    '''Thread that reports progress for the watchdog.
+
+    Subclasses call :meth:`heartbeat` whenever they make progress. A thread
+    stuck in a blocking call stops updating :attr:`heartbeat_time` even
+    though it is still alive.
+    '''
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.heartbeat_time = time.time()
+
+    def heartbeat(self):
+        self.heartbeat_time = time.time()
+
+
+class Supervisor(object):
+    '''Runs the worker threads and restarts the ones that fail.
+
+    Each component is registered with a factory that builds a fresh thread
+    since a :class:`threading.Thread` cannot be started twice. Only the
+    failed component is replaced; the others keep running. A component
+    that fails too often is considered broken and an exception is raised
+    so the process supervisor can take over.
+
+    A component with a stall timeout is also restarted when its heartbeat
+    is older than the timeout. The stalled thread cannot be killed so it
+    is told to stop and abandoned; being a daemon thread, it does not
+    prevent the process from exiting.
+    '''
+    def __init__(self):
+        self._factories = collections.OrderedDict()
+        self._stall_timeouts = {}
+        self._threads = {}
+        self._restart_times = collections.defaultdict(list)
+
+    def add(self, name, factory, stall_timeout=None):
+        self._factories[name] = factory
+        self._stall_timeouts[name] = stall_timeout
+
+    @property
+    def threads(self):
+        return [self._threads[name] for name in self._factories
+                if name in self._threads]
+
+    def get(self, name):
+        return self._threads.get(name)
+
+    def start(self, name=None):
+        if name:
+            return self._start_component(name)
+
+        for name in self._factories:
+            self._start_component(name)
+
+    def stop(self):
+        for thread in self.threads:
+            _logger.info('Stopping thread %s', thread)
+            thread.stop()
+            thread.join(1)
+
+    def check(self):
+        time_now = time.time()
+
+        for name in list(self._threads):
+            thread = self._threads[name]
+            stall_timeout = self._stall_timeouts[name]
+
+            if not thread.is_alive():
+                self._restart(name, 'died')
+            elif stall_timeout and \
+                    time_now - thread.heartbeat_time > stall_timeout:
+                self._restart(
+                    name, 'stalled for {:.0f} seconds'
+                    .format(time_now - thread.heartbeat_time)
+                )
+
+    def _start_component(self, name):
+        thread = self._factories[name]()
+        self._threads[name] = thread
+        thread.start()
+        return thread
+
+    def _restart(self, name, reason):
+        thread = self._threads[name]
+        _logger.error('Thread %s %s. Restarting.', thread, reason)
+
+        time_now = time.time()
+        restart_times = [
+            restart_time for restart_time in self._restart_times[name]
+            if time_now - restart_time < RESTART_WINDOW
+        ]
+
+        if len(restart_times) >= MAX_RESTARTS:
+            raise Exception('A thread failed too often: {}'.format(thread))
+
+        restart_times.append(time_now)
+        self._restart_times[name] = restart_times
+
+        thread.stop()
+        self._start_component(name)
+        events.publish('restart', name=name, reason=reason)
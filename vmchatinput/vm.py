@@ -8,21 +8,31 @@ import threading
 from six.moves import queue
 import time
 import collections
-import PIL.Image
-import PIL.ImageMath
 import six
 
 import virtualbox
 from virtualbox.library import MachineState, VBoxErrorIprtError, SessionState
 from vmchatinput.input import ChatInput
+from vmchatinput.latency import LatencyRecorder
+from vmchatinput.pacing import PacingController
+from vmchatinput.shedding import LoadShedder
+from vmchatinput import events, startup
+from vmchatinput.profiler import traced
+from vmchatinput.state import StateStore, STATE_SAVE_INTERVAL
+from vmchatinput.supervisor import HeartbeatThread
 
 _logger = logging.getLogger(__name__)
 
+MAX_BATCH_SIZE = 10
+LATENCY_REPORT_INTERVAL = 600
 
-class VMThread(threading.Thread):
+
+class VMThread(HeartbeatThread):
     def __init__(self, message_queue, machine_name, log_dir,
-                 minimized_gui=False):
-        threading.Thread.__init__(self)
+                 minimized_gui=False, standby=False, keyword_tables=None,
+                 adaptive_pacing=False, state_save_interval=STATE_SAVE_INTERVAL,
+                 latency_slo=None, latency_tracing=False, **logger_kwargs):
+        HeartbeatThread.__init__(self)
         self._message_queue = message_queue
         self._machine_name = machine_name
         self._log_dir = log_dir
@@ -32,29 +42,75 @@ class VMThread(threading.Thread):
         self._vbox = None
         self._vbox_machine = None
         self._vbox_session = None
-        self._chat_input = ChatInput(log_dir)
+        self._chat_input = ChatInput(
+            log_dir, keyword_tables, PacingController(adaptive_pacing),
+            LoadShedder(latency_slo), LatencyRecorder(latency_tracing),
+            **logger_kwargs
+        )
+        self._state_store = StateStore(log_dir, state_save_interval)
         self._frozen_checker = FrozenChecker()
+        self._active_event = threading.Event()
+        self._screenshot_persist_requested = False
+        self._latency_report_time = time.time()
+
+        if not standby:
+            self._active_event.set()
 
     def run(self):
         _logger.info('Starting VM client.')
 
         self._running = True
 
-        self._setup_virtualbox()
+        with startup.phase('virtualbox'):
+            self._setup_virtualbox()
 
-        while self._running:
-            try:
-                nick, message = self._message_queue.get(timeout=0.5)
-            except queue.Empty:
-                continue
+        if not self._active_event.is_set():
+            self._wait_for_activation()
 
-            if not self._start_machine_if_needed():
-                continue
+        # The state is restored after activation because the active process
+        # keeps saving it while this one is on standby.
+        self._restore_state()
+        self._state_store.start()
 
-            try:
-                self._process_input(nick, message)
-            except (ValueError, KeyError, TypeError, IndexError):
-                _logger.exception('Error processing input')
+        try:
+            while self._running:
+                self.heartbeat()
+
+                if self._screenshot_persist_requested:
+                    self._screenshot_persist_requested = False
+                    self._chat_input.input_logger.persist_screenshots(
+                        'request')
+
+                try:
+                    messages = [self._message_queue.get(timeout=0.5)]
+                except queue.Empty:
+                    continue
+
+                while len(messages) < MAX_BATCH_SIZE:
+                    try:
+                        messages.append(self._message_queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if self._chat_input.latency.enabled:
+                    self._record_queue_latency(messages)
+
+                if not self._start_machine_if_needed():
+                    continue
+
+                messages = self._chat_input.shedder.filter_batch(
+                    messages, self._message_queue.qsize())
+
+                if not messages:
+                    continue
+
+                try:
+                    self._process_input(messages)
+                except (ValueError, KeyError, TypeError, IndexError):
+                    _logger.exception('Error processing input')
+        finally:
+            self._state_store.stop()
+            self._chat_input.input_logger.persist_screenshots('stop')
 
         _logger.info('Stopped VM client.')
 
@@ -62,6 +118,56 @@ class VMThread(threading.Thread):
         _logger.info('Stopping VM client.')
         self._running = False
 
+    def activate(self):
+        self._active_event.set()
+
+    def set_keyword_tables(self, keyword_tables):
+        self._chat_input.set_keyword_tables(keyword_tables)
+
+    def request_screenshot_persist(self):
+        self._screenshot_persist_requested = True
+
+    def _wait_for_activation(self):
+        _logger.info('VM client on standby.')
+
+        # Messages received while on standby are stale by the time we take
+        # over so they are discarded instead of being left in the queue.
+        while self._running and not self._active_event.is_set():
+            self.heartbeat()
+
+            try:
+                self._message_queue.get(timeout=0.5)
+            except queue.Empty:
+                pass
+
+        _logger.info('VM client activated.')
+
+    def _record_queue_latency(self, messages):
+        latency = self._chat_input.latency
+        time_now = time.time()
+
+        for message in messages:
+            latency.record('queue', time_now - message[2])
+
+        if time_now - self._latency_report_time >= LATENCY_REPORT_INTERVAL:
+            self._latency_report_time = time_now
+            _logger.info('Input latency:\n%s', latency.format_report())
+            latency.reset()
+
+    def _restore_state(self):
+        state = self._state_store.load()
+
+        if not state:
+            return
+
+        try:
+            self._chat_input.set_state(state)
+        except (ValueError, KeyError, TypeError):
+            _logger.exception('Ignored bad saved state')
+        else:
+            _logger.info('Restored state at input %d',
+                         self._chat_input.input_counter)
+
     def _setup_virtualbox(self):
         self._vbox = virtualbox.VirtualBox()
         self._vbox_machine = self._vbox.find_machine(self._machine_name)
@@ -81,6 +187,7 @@ class VMThread(threading.Thread):
             self._vbox_session = virtualbox.Session()
             progress = self._vbox_machine.launch_vm_process(self._vbox_session)
             progress.wait_for_completion()
+            self.heartbeat()
 
             if self._minimized_gui:
                 self._minimize_vm_window()
@@ -103,12 +210,19 @@ class VMThread(threading.Thread):
             else:
                 return True
 
-    def _process_input(self, nick, message):
-        self._chat_input.process_input(nick, message,
-                                       self._vbox_session.console)
+    def _process_input(self, messages):
+        prev_input_count = self._chat_input.input_counter
+        start_time = time.time()
+        self._chat_input.process_batch(messages, self._vbox_session.console)
+        self._chat_input.shedder.record_batch(
+            len(messages), time.time() - start_time)
         input_count = self._chat_input.input_counter
+        self._state_store.update(self._chat_input.get_state())
+
+        if any(count % 100 == 0 or count == 5
+               for count in range(prev_input_count + 1, input_count + 1)):
+            changed = None
 
-        if input_count % 100 == 0 or input_count == 5:
             try:
                 image_data = self._screenshot()
             except VBoxErrorIprtError:
@@ -116,11 +230,23 @@ class VMThread(threading.Thread):
                 self._frozen_checker.increment_screenshot_error()
             else:
                 self._frozen_checker.add_image(image_data)
+                changed = self._frozen_checker.is_last_image_changed()
+
+            frozen = self._frozen_checker.is_frozen()
+            events.publish('frozen_check', frozen=frozen)
 
-            if self._frozen_checker.is_frozen():
+            if frozen:
                 _logger.warning('Machine appears frozen')
+                self._chat_input.input_logger.persist_screenshots('frozen')
+                events.publish('reset', reason='frozen')
                 self._reset_machine()
+                # The unchanged screens were a frozen guest, not congestion,
+                # so the delays they doubled are undone.
+                self._chat_input.pacing.reset()
+            elif changed is not None:
+                self._chat_input.pacing.record_screen_change(changed)
 
+    @traced('VMThread._screenshot')
     def _screenshot(self):
         width, height, _, _, _ = self._vbox_session.console.display\
             .get_screen_resolution(0)
@@ -162,6 +288,8 @@ class FrozenChecker(object):
         self._screenshot_error_count = 0
 
     def add_image(self, image_data):
+        import PIL.Image
+
         self._screenshot_error_count = 0
         image = PIL.Image.open(six.BytesIO(image_data)).convert('L')
         self._images.append(image)
@@ -190,7 +318,15 @@ class FrozenChecker(object):
     def increment_screenshot_error(self):
         self._screenshot_error_count += 1
 
+    def is_last_image_changed(self):
+        if len(self._images) < 2:
+            return None
+
+        return not self._is_image_equal(self._images[-2], self._images[-1])
+
     def _is_image_equal(self, image1, image2):
+        import PIL.ImageMath
+
         result_image = PIL.ImageMath.eval('abs(a - b)', a=image1, b=image2)
 
         return not result_image.getbbox()